@@ -0,0 +1,40 @@
+"""
+Process-local cache of WebSocket document access checks
+"""
+from typing import NamedTuple, Optional, Tuple
+import threading
+from cachetools import TTLCache
+
+
+class DocumentAccess(NamedTuple):
+    """One row of queries.document_access_check"""
+    is_public: bool
+    owner_id: Optional[str]
+    user_id: Optional[str]
+
+
+# (document_id, user_id or None) -> DocumentAccess. Short TTL bounds how
+# long a change made by another process can go unnoticed
+_access_cache: TTLCache = TTLCache(maxsize=10_000, ttl=30)
+_access_cache_lock = threading.Lock()
+
+
+def get_access(document_id: str, user_id: Optional[str]) -> Optional[DocumentAccess]:
+    """Return the cached access row, if any"""
+    with _access_cache_lock:
+        return _access_cache.get((document_id, user_id))
+
+
+def set_access(document_id: str, user_id: Optional[str], row: Tuple) -> DocumentAccess:
+    """Cache an access row and return it"""
+    access = DocumentAccess(*row)
+    with _access_cache_lock:
+        _access_cache[(document_id, user_id)] = access
+    return access
+
+
+def invalidate_document(document_id: str) -> None:
+    """Drop every cached decision for a document after a permission change"""
+    with _access_cache_lock:
+        for key in [key for key in _access_cache if key[0] == document_id]:
+            _access_cache.pop(key, None)
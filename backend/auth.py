@@ -1,16 +1,26 @@
 """
 Authentication and authorization utilities
 """
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional, Union
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+import time
+from hashlib import blake2b
+from cachetools import TTLCache
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
 import models
 import schemas
-from database import get_db
+from database import get_db, get_async_db
 import os
 
 # Configuration
@@ -18,21 +28,65 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-this-in-product
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_HOURS = int(os.getenv("JWT_EXPIRE_HOURS", "24"))
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing (argon2id; bcrypt only to verify hashes created before the switch)
+password_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+legacy_pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# Hashing is CPU-bound and releases the GIL, so keep it off the event loop
+_hash_pool = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="password-hash")
 
 # HTTP Bearer token scheme
 security = HTTPBearer()
 
+# Token digest -> (TokenData, exp) for recently verified JWTs
+_token_cache: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+_token_cache_lock = threading.Lock()
+
+# Digest of (username, password) -> stored hash it was verified against,
+# so a client retrying a login does not rerun argon2. Digests are keyed
+# with a per-process secret and are useless outside this process
+_login_cache: TTLCache = TTLCache(maxsize=10_000, ttl=5)
+_login_cache_lock = threading.Lock()
+_login_key_secret = os.urandom(32)
+
+# Username -> column values of recently loaded users
+_user_cache: TTLCache = TTLCache(maxsize=1_000, ttl=30)
+_user_cache_lock = threading.Lock()
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash"""
-    return pwd_context.verify(plain_password, hashed_password)
+    if not hashed_password.startswith("$argon2"):
+        return legacy_pwd_context.verify(plain_password, hashed_password)
+    
+    try:
+        return password_hasher.verify(hashed_password, plain_password)
+    except (VerificationError, InvalidHashError):
+        return False
 
 
 def get_password_hash(password: str) -> str:
     """Hash a password"""
-    return pwd_context.hash(password)
+    return password_hasher.hash(password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password in the hashing thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_pool, verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash a password in the hashing thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_pool, get_password_hash, password)
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Check if a stored hash uses a legacy scheme or outdated parameters"""
+    if not hashed_password.startswith("$argon2"):
+        return True
+    return password_hasher.check_needs_rehash(hashed_password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -49,22 +103,101 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
+def _token_key(token: str) -> bytes:
+    """Short cache key for a token, so raw tokens are never kept around"""
+    return blake2b(token.encode(), digest_size=16).digest()
+
+
 def verify_token(token: str) -> Optional[schemas.TokenData]:
     """Verify and decode a JWT token"""
+    key = _token_key(token)
+    with _token_cache_lock:
+        cached = _token_cache.get(key)
+    if cached is not None:
+        token_data, expires_at = cached
+        if expires_at is None or expires_at > time.time():
+            return token_data
+    
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             return None
         token_data = schemas.TokenData(username=username)
-        return token_data
     except JWTError:
         return None
+    
+    with _token_cache_lock:
+        _token_cache[key] = (token_data, payload.get("exp"))
+    return token_data
+
+
+def _login_key(username: str, password: str) -> bytes:
+    """Cache key for a username and password pair"""
+    return blake2b(
+        username.encode() + b"\0" + password.encode(),
+        key=_login_key_secret, digest_size=16
+    ).digest()
+
+
+def _cached_user(username: str) -> Optional[models.User]:
+    """Detached copy of a recently loaded user, if cached"""
+    with _user_cache_lock:
+        values = _user_cache.get(username)
+    if values is None:
+        return None
+    user = models.User(**values)
+    make_transient_to_detached(user)
+    return user
+
+
+def _cache_user(user: models.User) -> None:
+    """Remember a user's column values for later lookups"""
+    values = {
+        attr.key: getattr(user, attr.key)
+        for attr in models.User.__mapper__.column_attrs
+    }
+    with _user_cache_lock:
+        _user_cache[user.username] = values
 
 
 def get_user_by_username(db: Session, username: str) -> Optional[models.User]:
     """Get user by username"""
-    return db.query(models.User).filter(models.User.username == username).first()
+    cached = _cached_user(username)
+    if cached is not None:
+        # Attach the cached row to this session without a query
+        return db.merge(cached, load=False)
+    
+    user = db.query(models.User).filter(models.User.username == username).first()
+    if user is not None:
+        _cache_user(user)
+    return user
+
+
+def get_cached_user(username: str) -> Optional[models.User]:
+    """Detached user from the cache, without touching the database"""
+    return _cached_user(username)
+
+
+async def get_user_by_username_async(db: AsyncSession, username: str) -> Optional[models.User]:
+    """Get user by username on an async session"""
+    cached = _cached_user(username)
+    if cached is not None:
+        return await db.merge(cached, load=False)
+    
+    result = await db.execute(
+        select(models.User).where(models.User.username == username)
+    )
+    user = result.scalar_one_or_none()
+    if user is not None:
+        _cache_user(user)
+    return user
+
+
+def invalidate_user_cache(username: str) -> None:
+    """Drop a cached user after its row changed"""
+    with _user_cache_lock:
+        _user_cache.pop(username, None)
 
 
 def get_user_by_email(db: Session, email: str) -> Optional[models.User]:
@@ -72,42 +205,65 @@ def get_user_by_email(db: Session, email: str) -> Optional[models.User]:
     return db.query(models.User).filter(models.User.email == email).first()
 
 
-def authenticate_user(db: Session, username: str, password: str) -> Union[models.User, bool]:
+async def get_user_by_email_async(db: AsyncSession, email: str) -> Optional[models.User]:
+    """Get user by email on an async session"""
+    result = await db.execute(
+        select(models.User).where(models.User.email == email)
+    )
+    return result.scalar_one_or_none()
+
+
+async def authenticate_user(db: AsyncSession, username: str, password: str) -> Union[models.User, bool]:
     """Authenticate a user with username and password"""
-    user = get_user_by_username(db, username)
+    user = await get_user_by_username_async(db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
-        return False
+    
+    # Only successful checks are cached, and only against the same hash
+    key = _login_key(username, password)
+    with _login_cache_lock:
+        verified_hash = _login_cache.get(key)
+    if verified_hash != user.hashed_password:
+        if not await verify_password_async(password, user.hashed_password):
+            return False
+        with _login_cache_lock:
+            _login_cache[key] = user.hashed_password
+    
+    # Upgrade legacy bcrypt hashes now that we know the plain password
+    if password_needs_rehash(user.hashed_password):
+        user.hashed_password = await get_password_hash_async(password)
+        await db.commit()
+        invalidate_user_cache(user.username)
+    
     return user
 
 
-def create_user(db: Session, user: schemas.UserCreate) -> models.User:
+async def create_user(db: AsyncSession, user: schemas.UserCreate) -> models.User:
     """Create a new user"""
     # Check if username already exists
-    if get_user_by_username(db, user.username):
+    if await get_user_by_username_async(db, user.username):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered"
         )
     
     # Check if email already exists (if provided)
-    if user.email and get_user_by_email(db, user.email):
+    if user.email and await get_user_by_email_async(db, user.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
     # Create new user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     db_user = models.User(
         username=user.username,
         email=user.email,
-        hashed_password=hashed_password
+        hashed_password=hashed_password,
+        created_at=datetime.now(timezone.utc)
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
     return db_user
 
 
@@ -145,6 +301,40 @@ async def get_current_active_user(
     return current_user
 
 
+async def get_current_user_async(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_async_db)
+) -> models.User:
+    """Get the current authenticated user, attached to an async session"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    
+    token_data = verify_token(credentials.credentials)
+    if token_data is None:
+        raise credentials_exception
+    
+    user = await get_user_by_username_async(db, token_data.username)
+    if user is None:
+        raise credentials_exception
+    
+    return user
+
+
+async def get_current_active_user_async(
+    current_user: models.User = Depends(get_current_user_async)
+) -> models.User:
+    """Get the current active user, attached to an async session"""
+    if not current_user.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Inactive user"
+        )
+    return current_user
+
+
 def create_guest_token(site_id: str) -> str:
     """Create a temporary token for guest users"""
     data = {
@@ -0,0 +1,34 @@
+"""
+Storage encoding for persisted CRDT state
+"""
+from typing import Any, Dict, Optional, Union
+import zlib
+import orjson
+
+# Low levels are nearly as small on redundant CRDT JSON and much cheaper
+# to produce on every periodic save
+COMPRESSION_LEVEL = 3
+
+
+def encode_crdt(state: Union[Dict[str, Any], bytes]) -> bytes:
+    """Serialize a CRDT state dict, or compress its JSON, into a blob"""
+    if not isinstance(state, bytes):
+        state = orjson.dumps(state)
+    return zlib.compress(state, COMPRESSION_LEVEL)
+
+
+def decode_crdt(blob: Optional[Union[bytes, str]]) -> Optional[Dict[str, Any]]:
+    """
+    Inverse of encode_crdt.
+
+    Rows written before the column became binary hold plain JSON, so
+    uncompressed payloads (str or bytes) are still accepted.
+    """
+    if not blob:
+        return None
+    if isinstance(blob, str):
+        return orjson.loads(blob)
+    blob = bytes(blob)
+    if blob[:1] in (b'{', b'['):
+        return orjson.loads(blob)
+    return orjson.loads(zlib.decompress(blob))
@@ -1,52 +1,50 @@
 """
 CRDT Node implementation for Sequence CRDT (Logoot algorithm)
 """
-from typing import List, Any, Dict, Optional
-import json
-from dataclasses import dataclass, asdict
+from typing import List, Any, Dict, Optional, Tuple, Union
+from array import array
+import struct
+from dataclasses import dataclass, field
 
 
-@dataclass
+@dataclass(slots=True)
 class Position:
     """Represents a position in the CRDT sequence"""
-    identifiers: List[int]
+    identifiers: Union[List[int], array]
     site_id: str
+    _key: Tuple[bytes, str] = field(init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        # Identifiers are u32s kept in a packed array rather than a list of
+        # int objects. Packed big-endian they compare with a single memcmp,
+        # shorter prefixes first, exactly like the old element-wise loop.
+        self.identifiers = array('I', self.identifiers)
+        packed = struct.pack(f'>{len(self.identifiers)}I', *self.identifiers)
+        self._key = (packed, self.site_id)
+    
+    def sort_key(self) -> Tuple[bytes, str]:
+        """Return the tuple key that orders this position"""
+        return self._key
     
     def __lt__(self, other: 'Position') -> bool:
         """Compare positions for ordering"""
         if not isinstance(other, Position):
             return NotImplemented
-        
-        # Compare identifier lists first
-        min_len = min(len(self.identifiers), len(other.identifiers))
-        
-        for i in range(min_len):
-            if self.identifiers[i] < other.identifiers[i]:
-                return True
-            elif self.identifiers[i] > other.identifiers[i]:
-                return False
-        
-        # If all compared identifiers are equal, shorter list comes first
-        if len(self.identifiers) != len(other.identifiers):
-            return len(self.identifiers) < len(other.identifiers)
-        
-        # If identifier lists are identical, compare site_id
-        return self.site_id < other.site_id
+        return self._key < other._key
     
-    def __eq__(self, other: 'Position') -> bool:
+    def __eq__(self, other: object) -> bool:
         """Check if positions are equal"""
         if not isinstance(other, Position):
             return NotImplemented
-        return (self.identifiers == other.identifiers and 
-                self.site_id == other.site_id)
+        return self._key == other._key
     
     def __hash__(self) -> int:
         """Make Position hashable"""
-        return hash((tuple(self.identifiers), self.site_id))
+        return hash(self._key)
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for JSON serialization"""
-        return asdict(self)
+        return {'identifiers': list(self.identifiers), 'site_id': self.site_id}
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'Position':
@@ -54,7 +52,7 @@ class Position:
         return cls(**data)
 
 
-@dataclass
+@dataclass(slots=True)
 class CRDTNode:
     """Represents a character node in the CRDT sequence"""
     position: Position
@@ -67,7 +65,7 @@ class CRDTNode:
             return NotImplemented
         return self.position < other.position
     
-    def __eq__(self, other: 'CRDTNode') -> bool:
+    def __eq__(self, other: object) -> bool:
         """Check if nodes are equal"""
         if not isinstance(other, CRDTNode):
             return NotImplemented
@@ -98,6 +96,8 @@ class CRDTNode:
 class CRDTOperation:
     """Represents a CRDT operation (insert or delete)"""
     
+    __slots__ = ('type', 'node', 'origin')
+    
     def __init__(self, op_type: str, node: CRDTNode, origin: str):
         self.type = op_type  # 'insert' or 'delete'
         self.node = node
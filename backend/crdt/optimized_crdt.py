@@ -1,52 +1,405 @@
 """
 Optimized CRDT implementation with better memory management
 """
-import json
 import time
-from typing import Dict, List, Optional, Any, Set
-from dataclasses import dataclass, asdict
+import uuid
+from typing import Dict, List, Optional, Any, Set, Tuple, Iterator, Deque
+from array import array
+from collections import deque
+from itertools import compress
+from dataclasses import dataclass
 import hashlib
 import logging
+import orjson
 
 logger = logging.getLogger(__name__)
 
-@dataclass
+# Serialized bytes of a sequence entry besides its id and char: keys,
+# punctuation, the visible flag and a float timestamp
+_ENTRY_OVERHEAD = 70
+
+# (id, char, visible, timestamp) as stored column-wise in a CharRun
+Entry = Tuple[str, str, bool, float]
+
+@dataclass(slots=True)
 class CRDTNode:
     """Single character node in the CRDT sequence"""
     id: str  # Unique identifier
     char: str  # Character value
     visible: bool = True  # Is the character visible
     timestamp: float = 0  # For conflict resolution
-    
+
     def to_dict(self) -> dict:
-        return asdict(self)
-    
+        return {
+            "id": self.id,
+            "char": self.char,
+            "visible": self.visible,
+            "timestamp": self.timestamp
+        }
+
     @classmethod
     def from_dict(cls, data: dict) -> 'CRDTNode':
         return cls(**data)
 
 
+class CharRun:
+    """
+    Run of consecutive characters stored column-wise.
+
+    A run replaces up to LEAF_CAPACITY CRDTNode objects: the characters live
+    in one string, visibility in a bytearray and timestamps in a float array,
+    so each character costs an id reference plus a few bytes.
+    """
+
+    __slots__ = ('ids', 'text', 'visible', 'timestamps')
+
+    def __init__(
+        self,
+        ids: List[str],
+        text: str,
+        visible: bytearray,
+        timestamps: array
+    ):
+        self.ids = ids
+        self.text = text
+        self.visible = visible
+        self.timestamps = timestamps
+
+    @classmethod
+    def from_entries(cls, entries: List[Entry]) -> 'CharRun':
+        return cls(
+            [e[0] for e in entries],
+            ''.join(e[1] for e in entries),
+            bytearray(1 if e[2] else 0 for e in entries),
+            array('d', (e[3] for e in entries))
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def insert(self, offset: int, node: CRDTNode):
+        self.ids.insert(offset, node.id)
+        self.text = self.text[:offset] + node.char + self.text[offset:]
+        self.visible.insert(offset, 1 if node.visible else 0)
+        self.timestamps.insert(offset, node.timestamp)
+
+    def split(self) -> 'CharRun':
+        """Move the upper half of this run into a new run"""
+        half = len(self.ids) // 2
+        right = CharRun(
+            self.ids[half:],
+            self.text[half:],
+            self.visible[half:],
+            self.timestamps[half:]
+        )
+        del self.ids[half:]
+        self.text = self.text[:half]
+        del self.visible[half:]
+        del self.timestamps[half:]
+        return right
+
+    def visible_text(self) -> str:
+        if 0 not in self.visible:
+            return self.text
+        return ''.join(compress(self.text, self.visible))
+
+    def entries(self) -> Iterator[Entry]:
+        return zip(self.ids, self.text, map(bool, self.visible), self.timestamps)
+
+
+class PositionTree:
+    """
+    Order-statistics container for the CRDT sequence.
+
+    Characters are kept in document order inside bounded CharRun leaves. A
+    Fenwick tree over the per-run visible counts maps a visible index to its
+    run in O(log n), so translating an editor position no longer walks the
+    document.
+
+    Ids are indexed too: a dict maps each id to its run, and a max-segment
+    tree over the largest id of every run finds the first run holding an id
+    greater than a given one, which is where remote inserts are placed.
+    """
+
+    LEAF_CAPACITY = 256
+
+    def __init__(self, entries: Optional[List[Entry]] = None):
+        self._runs: List[CharRun] = []
+        self._counts: List[int] = []  # Visible characters per run
+        self._index: List[int] = [0]  # Fenwick tree over _counts (1-based)
+        self._size = 0
+        self.visible_count = 0
+        self._owner: Dict[str, CharRun] = {}  # id -> run holding it
+        self._run_index: Dict[CharRun, int] = {}  # run -> position in _runs
+        self._max_ids: List[str] = []  # Largest id per run
+        self._max_tree: List[str] = ['', '']  # Max-segment tree over _max_ids
+
+        if entries:
+            self._load(entries)
+
+    def _load(self, entries: List[Entry]):
+        """Bulk-load characters, leaving room in each run to grow"""
+        step = self.LEAF_CAPACITY // 2
+        self._runs = [
+            CharRun.from_entries(entries[i:i + step])
+            for i in range(0, len(entries), step)
+        ]
+        self._counts = [run.visible.count(1) for run in self._runs]
+        self._size = len(entries)
+        self.visible_count = sum(self._counts)
+        self._owner = {
+            node_id: run for run in self._runs for node_id in run.ids
+        }
+        self._rebuild_index()
+
+    def _rebuild_index(self):
+        """Rebuild the Fenwick tree after the run layout changed"""
+        index = [0] * (len(self._counts) + 1)
+        for i, count in enumerate(self._counts, 1):
+            index[i] += count
+            parent = i + (i & -i)
+            if parent < len(index):
+                index[parent] += index[i]
+        self._index = index
+
+        self._run_index = {run: i for i, run in enumerate(self._runs)}
+        self._max_ids = [max(run.ids, default='') for run in self._runs]
+        size = 1 << max(len(self._runs) - 1, 0).bit_length()
+        tree = [''] * (2 * size)
+        tree[size:size + len(self._max_ids)] = self._max_ids
+        for i in range(size - 1, 0, -1):
+            tree[i] = max(tree[2 * i], tree[2 * i + 1])
+        self._max_tree = tree
+
+    def _raise_max_id(self, run_idx: int, node_id: str):
+        """Record a new id in a run's max-id and its segment tree ancestors"""
+        if node_id <= self._max_ids[run_idx]:
+            return
+        self._max_ids[run_idx] = node_id
+        tree = self._max_tree
+        i = run_idx + len(tree) // 2
+        while i and tree[i] < node_id:
+            tree[i] = node_id
+            i >>= 1
+
+    def _adjust(self, run_idx: int, delta: int):
+        """Update the visible count of a run and its Fenwick ancestors"""
+        self._counts[run_idx] += delta
+        self.visible_count += delta
+        index = self._index
+        i = run_idx + 1
+        while i < len(index):
+            index[i] += delta
+            i += i & -i
+
+    def _split(self, run_idx: int):
+        """Split an overfull run in two"""
+        right = self._runs[run_idx].split()
+        for node_id in right.ids:
+            self._owner[node_id] = right
+        right_count = right.visible.count(1)
+        self._runs.insert(run_idx + 1, right)
+        self._counts[run_idx] -= right_count
+        self._counts.insert(run_idx + 1, right_count)
+        self._rebuild_index()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def runs(self) -> List[CharRun]:
+        return self._runs
+
+    def entries(self) -> Iterator[Entry]:
+        """Iterate (id, char, visible, timestamp) tuples in document order"""
+        for run in self._runs:
+            yield from run.entries()
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self._owner
+
+    def find(self, node_id: str) -> Optional[Tuple[int, int]]:
+        """Locate a character by id"""
+        run = self._owner.get(node_id)
+        if run is None:
+            return None
+        return self._run_index[run], run.ids.index(node_id)
+
+    def slot_before_greater_id(self, node_id: str) -> Tuple[int, int]:
+        """Slot before the first character (in document order) whose id is greater"""
+        tree = self._max_tree
+        if not self._runs or tree[1] <= node_id:
+            return self.end_slot()
+
+        # Descend to the leftmost run whose largest id exceeds node_id
+        i = 1
+        size = len(tree) // 2
+        while i < size:
+            i *= 2
+            if tree[i] <= node_id:
+                i += 1
+        run_idx = i - size
+
+        for offset, existing_id in enumerate(self._runs[run_idx].ids):
+            if node_id < existing_id:
+                return run_idx, offset
+        return self.end_slot()
+
+    def end_slot(self) -> Tuple[int, int]:
+        """Slot just past the last character"""
+        if not self._runs:
+            return 0, 0
+        return len(self._runs) - 1, len(self._runs[-1])
+
+    def select(self, k: int) -> Tuple[int, int]:
+        """Locate the k-th visible character (0-based) as a (run, offset) slot"""
+        if k < 0 or k >= self.visible_count:
+            raise IndexError(f"Visible index {k} out of range")
+
+        # Fenwick descent: find the run whose prefix sum first exceeds k
+        index = self._index
+        run_idx = 0
+        step = 1 << (len(index) - 1).bit_length()
+        while step:
+            nxt = run_idx + step
+            if nxt < len(index) and index[nxt] <= k:
+                run_idx = nxt
+                k -= index[nxt]
+            step >>= 1
+
+        visible = self._runs[run_idx].visible
+        offset = visible.find(1)
+        while k:
+            offset = visible.find(1, offset + 1)
+            k -= 1
+        if offset < 0:
+            raise IndexError("Position index is inconsistent")
+        return run_idx, offset
+
+    def slot_for_position(self, position: int) -> Tuple[int, int]:
+        """Insertion slot directly after the (position - 1)-th visible character"""
+        if position <= 0:
+            return 0, 0
+        if position > self.visible_count:
+            return self.end_slot()
+        run_idx, offset = self.select(position - 1)
+        return run_idx, offset + 1
+
+    def insert(self, run_idx: int, offset: int, node: CRDTNode):
+        """Insert a character at the given slot"""
+        if not self._runs:
+            self._runs.append(CharRun([], '', bytearray(), array('d')))
+            self._counts.append(0)
+            self._rebuild_index()
+
+        run = self._runs[run_idx]
+        run.insert(offset, node)
+        self._owner[node.id] = run
+        self._raise_max_id(run_idx, node.id)
+        self._size += 1
+
+        if node.visible:
+            self._adjust(run_idx, 1)
+
+        if len(run) > self.LEAF_CAPACITY:
+            self._split(run_idx)
+
+    def hide(self, run_idx: int, offset: int) -> str:
+        """Mark the character at the given slot as deleted, returning its id"""
+        run = self._runs[run_idx]
+        if run.visible[offset]:
+            run.visible[offset] = 0
+            self._adjust(run_idx, -1)
+        return run.ids[offset]
+
+
 class OptimizedSequenceCRDT:
     """
     Optimized CRDT for text editing with memory management
     """
-    
+
     def __init__(self, site_id: str):
         self.site_id = site_id
-        self.sequence: List[CRDTNode] = []
-        self.tombstones: Set[str] = set()  # Track deleted nodes by ID only
+        self._id_prefix = f"{site_id}:"
+        self.sequence = PositionTree()
+        # Deletes that arrived before their insert
+        self.pending_deletes: Set[str] = set()
         self.version = 0
         self.last_compaction = time.time()
         self.compaction_threshold = 1000  # Compact after 1000 operations
         self.operations_since_compaction = 0
-        
+        # Derived views of the state, rebuilt lazily after it changes.
+        # The cached to_dict() result is shared, so callers must not mutate it.
+        self._checksum: Optional[str] = None
+        self._dict: Optional[Dict[str, Any]] = None
+        self._json: Optional[bytes] = None
+        # Running estimate of len(to_json()), exact whenever to_json() runs
+        # and grown per operation in between; None means unknown
+        self._state_size: Optional[int] = None
+        self._text: Optional[str] = None
+        # Count of applied operations, plus a bounded log of the latest ones
+        # so peers that are only slightly behind can catch up with a delta.
+        # log_id changes whenever the log restarts (e.g. reloaded state).
+        self.op_counter = 0
+        self.log_id = uuid.uuid4().hex
+        self._op_log: Deque[Tuple[int, Dict[str, Any]]] = deque(maxlen=10_000)
+
+    def _record(self, operation: Dict[str, Any]):
+        """Count an applied operation and append it to the delta log"""
+        self.op_counter += 1
+        self._op_log.append((self.op_counter, operation))
+        self._state_changed()
+        self._text = None
+        if self._state_size is not None:
+            self._state_size += self._estimated_growth(operation)
+
+    @staticmethod
+    def _estimated_growth(operation: Dict[str, Any]) -> int:
+        """Approximate bytes an applied operation adds to to_json()"""
+        op_type = operation.get("type")
+        if op_type == "insert":
+            node = operation["node"]
+            return _ENTRY_OVERHEAD + len(node["id"]) + len(node["char"])
+        if op_type == "insert_run":
+            # Ids are site:version:position, a dozen digits or so past the site
+            id_length = len(operation["site_id"]) + 12
+            return len(operation["text"]) * (_ENTRY_OVERHEAD + id_length + 1)
+        # A delete lists the node id among the tombstones
+        node_id = operation.get("node_id")
+        return len(node_id) + 3 if isinstance(node_id, str) else 40
+
+    def _state_changed(self):
+        """Drop cached serializations of the state"""
+        self._checksum = None
+        self._dict = None
+        self._json = None
+
+    def get_delta_since(self, op_counter: int, log_id: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Operations applied after op_counter, or None if they are no longer
+        in the log and the peer needs the full state instead
+        """
+        if log_id != self.log_id or op_counter > self.op_counter:
+            return None
+        if op_counter == self.op_counter:
+            return []
+        if not self._op_log or self._op_log[0][0] > op_counter + 1:
+            return None
+
+        delta = []
+        for counter, operation in reversed(self._op_log):
+            if counter <= op_counter:
+                break
+            delta.append(operation)
+        delta.reverse()
+        return delta
+
     def insert(self, position: int, char: str) -> Optional[Dict[str, Any]]:
         """Insert a character at the given position"""
         try:
             # Generate unique ID
-            node_id = f"{self.site_id}:{self.version}:{position}"
+            node_id = f"{self._id_prefix}{self.version}:{position}"
             self.version += 1
-            
+
             # Create new node
             node = CRDTNode(
                 id=node_id,
@@ -54,102 +407,150 @@ class OptimizedSequenceCRDT:
                 visible=True,
                 timestamp=time.time()
             )
-            
-            # Find insertion point
-            visible_pos = 0
-            insert_idx = 0
-            
-            for i, n in enumerate(self.sequence):
-                if visible_pos == position:
-                    insert_idx = i
-                    break
-                if n.visible and n.id not in self.tombstones:
-                    visible_pos += 1
-            else:
-                insert_idx = len(self.sequence)
-            
-            # Insert node
-            self.sequence.insert(insert_idx, node)
+
+            # Find insertion point and insert node
+            run_idx, offset = self.sequence.slot_for_position(position)
+            self.sequence.insert(run_idx, offset, node)
             self.operations_since_compaction += 1
-            
-            # Check if compaction needed
-            if self.operations_since_compaction >= self.compaction_threshold:
-                self._compact()
-            
-            return {
+
+            operation = {
                 "type": "insert",
                 "node": node.to_dict(),
                 "position": position
             }
-            
+            self._record(operation)
+
+            # Check if compaction needed
+            if self.operations_since_compaction >= self.compaction_threshold:
+                self._compact()
+
+            return operation
+
         except Exception as e:
             logger.error(f"Insert error: {e}")
             return None
-    
+
+    def insert_batch(self, position: int, text: str) -> Optional[Dict[str, Any]]:
+        """
+        Insert a run of characters typed at one position as a single
+        'insert_run' operation. Node ids follow the per-character scheme
+        (site:version+i:position+i), so the op only carries the start.
+        """
+        try:
+            if not text:
+                return None
+
+            start_version = self.version
+            timestamp = time.time()
+            for i, char in enumerate(text):
+                node = CRDTNode(
+                    id=f"{self._id_prefix}{start_version + i}:{position + i}",
+                    char=char,
+                    visible=True,
+                    timestamp=timestamp
+                )
+                run_idx, offset = self.sequence.slot_for_position(position + i)
+                self.sequence.insert(run_idx, offset, node)
+            self.version += len(text)
+            self.operations_since_compaction += len(text)
+
+            operation = {
+                "type": "insert_run",
+                "site_id": self.site_id,
+                "version": start_version,
+                "position": position,
+                "text": text,
+                "timestamp": timestamp
+            }
+            self._record(operation)
+
+            if self.operations_since_compaction >= self.compaction_threshold:
+                self._compact()
+
+            return operation
+
+        except Exception as e:
+            logger.error(f"Insert batch error: {e}")
+            return None
+
     def delete(self, position: int) -> Optional[Dict[str, Any]]:
         """Delete character at position"""
         try:
-            visible_pos = 0
-            for node in self.sequence:
-                if node.visible and node.id not in self.tombstones:
-                    if visible_pos == position:
-                        # Mark as tombstone
-                        self.tombstones.add(node.id)
-                        node.visible = False
-                        self.operations_since_compaction += 1
-                        
-                        # Check if compaction needed
-                        if self.operations_since_compaction >= self.compaction_threshold:
-                            self._compact()
-                        
-                        return {
-                            "type": "delete",
-                            "node_id": node.id,
-                            "position": position
-                        }
-                    visible_pos += 1
-            
-            return None
-            
+            if position < 0 or position >= self.sequence.visible_count:
+                return None
+
+            run_idx, offset = self.sequence.select(position)
+            node_id = self.sequence.hide(run_idx, offset)
+            self.operations_since_compaction += 1
+
+            operation = {
+                "type": "delete",
+                "node_id": node_id,
+                "position": position
+            }
+            self._record(operation)
+
+            # Check if compaction needed
+            if self.operations_since_compaction >= self.compaction_threshold:
+                self._compact()
+
+            return operation
+
         except Exception as e:
             logger.error(f"Delete error: {e}")
             return None
-    
+
     def apply_remote(self, operation: Dict[str, Any]) -> bool:
         """Apply operation from remote site"""
         try:
             op_type = operation.get("type")
-            
+
             if op_type == "insert":
                 node_data = operation.get("node")
                 if not node_data:
                     return False
-                
+
                 # Remove 'position' field if present (from old format)
                 if 'position' in node_data:
                     del node_data['position']
-                
+
                 # Ensure all required fields are present
                 if 'id' not in node_data or 'char' not in node_data:
                     return False
-                
+
                 # Set defaults for optional fields
                 if 'visible' not in node_data:
                     node_data['visible'] = True
                 if 'timestamp' not in node_data:
                     node_data['timestamp'] = time.time()
-                
+
                 node = CRDTNode.from_dict(node_data)
-                
-                # Check if already exists
-                if any(n.id == node.id for n in self.sequence):
+
+                if not self._integrate(node):
                     return True  # Already applied
-                
-                # Find insertion position based on ID
-                insert_idx = self._find_insert_position(node.id)
-                self.sequence.insert(insert_idx, node)
-                self.operations_since_compaction += 1
-                
+
+            elif op_type == "insert_run":
+                site_id = operation.get("site_id")
+                version = operation.get("version")
+                position = operation.get("position")
+                text = operation.get("text")
+                if site_id is None or version is None or position is None or not text:
+                    return False
+
+                timestamp = operation.get("timestamp") or time.time()
+                applied = 0
+                for i, char in enumerate(text):
+                    node = CRDTNode(
+                        id=f"{site_id}:{version + i}:{position + i}",
+                        char=char,
+                        visible=True,
+                        timestamp=timestamp
+                    )
+                    applied += self._integrate(node)
+
+                if not applied:
+                    return True  # Already applied
+
             elif op_type == "delete":
                 node_id = operation.get("node_id")
                 if not node_id:
@@ -157,106 +558,172 @@ class OptimizedSequenceCRDT:
                     node_data = operation.get("node")
                     if node_data and isinstance(node_data, dict):
                         node_id = node_data.get("id")
-                
+
                 if not node_id:
                     return False
-                
-                # Add to tombstones
-                self.tombstones.add(node_id)
-                
+
                 # Mark node as invisible
-                for node in self.sequence:
-                    if node.id == node_id:
-                        node.visible = False
-                        break
-                
+                slot = self.sequence.find(node_id)
+                if slot is not None:
+                    self.sequence.hide(*slot)
+                else:
+                    self.pending_deletes.add(node_id)
+
                 self.operations_since_compaction += 1
-            
+
             else:
                 return False
-            
+
+            self._record(operation)
+
             # Check if compaction needed
             if self.operations_since_compaction >= self.compaction_threshold:
                 self._compact()
-            
+
             return True
-            
+
         except Exception as e:
             logger.error(f"Apply remote error: {e}")
             return False
-    
+
+    def _integrate(self, node: CRDTNode) -> bool:
+        """Place a remote node by id ordering; False if it already exists"""
+        if node.id in self.sequence:
+            return False
+
+        # A delete for this node may have overtaken the insert
+        if node.id in self.pending_deletes:
+            self.pending_deletes.discard(node.id)
+            node.visible = False
+
+        # Find insertion position based on ID
+        run_idx, offset = self.sequence.slot_before_greater_id(node.id)
+        self.sequence.insert(run_idx, offset, node)
+        self.operations_since_compaction += 1
+        return True
+
     def get_text(self) -> str:
         """Get the current text content"""
-        chars = []
-        for node in self.sequence:
-            if node.visible and node.id not in self.tombstones:
-                chars.append(node.char)
-        return ''.join(chars)
-    
-    def _find_insert_position(self, node_id: str) -> int:
-        """Find correct insertion position based on ID ordering"""
-        # Simple lexicographic ordering of IDs
-        for i, node in enumerate(self.sequence):
-            if node_id < node.id:
-                return i
-        return len(self.sequence)
-    
+        if self._text is None:
+            self._text = ''.join([run.visible_text() for run in self.sequence.runs()])
+        return self._text
+
     def _compact(self):
         """Remove old tombstones to save memory"""
         try:
             current_time = time.time()
-            
+
             # Only compact if enough time has passed
             if current_time - self.last_compaction < 60:  # Minimum 1 minute between compactions
                 return
-            
+
             # Remove very old invisible nodes (older than 5 minutes)
             cutoff_time = current_time - 300
-            
-            new_sequence = []
-            removed_tombstones = set()
-            
-            for node in self.sequence:
-                if node.visible or node.timestamp > cutoff_time:
-                    new_sequence.append(node)
-                else:
-                    removed_tombstones.add(node.id)
-            
-            # Update sequence and tombstones
-            self.sequence = new_sequence
-            self.tombstones -= removed_tombstones
-            
+
+            kept = [
+                entry for entry in self.sequence.entries()
+                if entry[2] or entry[3] > cutoff_time
+            ]
+            removed = len(self.sequence) - len(kept)
+
+            # Rebuild the position index over the surviving nodes
+            self.sequence = PositionTree(kept)
+            self._state_changed()
+            self._state_size = None
+
             self.last_compaction = current_time
             self.operations_since_compaction = 0
-            
-            logger.info(f"Compacted CRDT: removed {len(removed_tombstones)} nodes")
-            
+
+            logger.info(f"Compacted CRDT: removed {removed} nodes")
+
         except Exception as e:
             logger.error(f"Compaction error: {e}")
-    
+
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for serialization"""
-        return {
+        if self._dict is not None:
+            return self._dict
+
+        sequence = [
+            {"id": node_id, "char": char, "visible": visible, "timestamp": timestamp}
+            for node_id, char, visible, timestamp in self.sequence.entries()
+        ]
+        tombstones = [
+            node_id
+            for run in self.sequence.runs()
+            for node_id, visible in zip(run.ids, run.visible)
+            if not visible
+        ]
+        tombstones.extend(self.pending_deletes)
+
+        self._dict = {
             "site_id": self.site_id,
             "version": self.version,
-            "sequence": [node.to_dict() for node in self.sequence],
-            "tombstones": list(self.tombstones)
+            "sequence": sequence,
+            "tombstones": tombstones
         }
-    
+        return self._dict
+
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'OptimizedSequenceCRDT':
         """Create from dictionary"""
         crdt = cls(data["site_id"])
         crdt.version = data.get("version", 0)
-        crdt.sequence = [CRDTNode.from_dict(n) for n in data.get("sequence", [])]
-        crdt.tombstones = set(data.get("tombstones", []))
+
+        tombstones = set(data.get("tombstones", []))
+        entries = []
+        for n in data.get("sequence", []):
+            node_id = n["id"]
+            visible = n.get("visible", True)
+            if node_id in tombstones:
+                visible = False
+                tombstones.discard(node_id)
+            entries.append((node_id, n["char"], visible, n.get("timestamp", 0)))
+
+        crdt.sequence = PositionTree(entries)
+        crdt.pending_deletes = tombstones
         return crdt
-    
+
+    def to_json(self) -> bytes:
+        """to_dict() serialized as JSON, shared by every caller until the state changes"""
+        if self._json is None:
+            self._json = orjson.dumps(self.to_dict())
+            self._state_size = len(self._json)
+        return self._json
+
     def get_state_size(self) -> int:
-        """Get approximate size of state in bytes"""
-        return len(json.dumps(self.to_dict()))
-    
+        """
+        Get approximate size of state in bytes.
+
+        Serializes only when no estimate exists yet; after that the
+        estimate is grown per operation, so checking it on every batch
+        stays cheap.
+        """
+        if self._state_size is None:
+            return len(self.to_json())
+        return self._state_size
+
     def generate_checksum(self) -> str:
         """Generate checksum of current state"""
-        state_str = json.dumps(self.to_dict(), sort_keys=True)
-        return hashlib.md5(state_str.encode()).hexdigest()
\ No newline at end of file
+        if self._checksum is not None:
+            return self._checksum
+
+        # Hash each column as one stream, independent of how it is split
+        # into runs, rather than hashing a JSON rendering of the state
+        ids, text, visible, timestamps = (
+            hashlib.blake2b(digest_size=16) for _ in range(4)
+        )
+        for run in self.sequence.runs():
+            ids.update(''.join([node_id + '\0' for node_id in run.ids]).encode())
+            text.update(run.text.encode())
+            visible.update(run.visible)
+            timestamps.update(run.timestamps.tobytes())
+
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{self.site_id}\0{self.version}\0".encode())
+        for column in (ids, text, visible, timestamps):
+            h.update(column.digest())
+        h.update('\0'.join(sorted(self.pending_deletes)).encode())
+
+        self._checksum = h.hexdigest()
+        return self._checksum
@@ -4,7 +4,6 @@ Sequence CRDT implementation using Logoot algorithm
 from typing import List, Dict, Any, Optional, Tuple
 import random
 import bisect
-import json
 from .node import CRDTNode, Position, CRDTOperation
 
 
@@ -14,9 +13,22 @@ class SequenceCRDT:
     Based on the Logoot algorithm for conflict-free replicated data types
     """
     
+    # Largest step taken from a bound when allocating an identifier
+    BOUNDARY = 2**16
+    # Identifiers are u32s; this is also the END boundary's identifier
+    MAX_IDENTIFIER = 2**31 - 1
+    
     def __init__(self, site_id: str):
         self.site_id = site_id
+        # Private RNG: cheaper than the module-level one and never shared
+        self._rng = random.Random()
         self.nodes: List[CRDTNode] = []
+        # Sort keys parallel to self.nodes so bisect compares plain tuples
+        self._keys: List[Tuple[bytes, str]] = []
+        # Visible nodes in order, maintained incrementally on every edit
+        self._visible_nodes: List[CRDTNode] = []
+        self._visible_keys: List[Tuple[bytes, str]] = []
+        self._visible_count = 0
         self.clock = 0
         
         # Add boundary nodes (beginning and end markers)
@@ -29,62 +41,115 @@ class SequenceCRDT:
         begin_node = CRDTNode(begin_pos, "", visible=False)
         
         # End boundary node  
-        end_pos = Position([2**31 - 1], "END")
+        end_pos = Position([self.MAX_IDENTIFIER], "END")
         end_node = CRDTNode(end_pos, "", visible=False)
         
         self.nodes = [begin_node, end_node]
+        self._keys = [begin_pos.sort_key(), end_pos.sort_key()]
+    
+    def _insert_node(self, node: CRDTNode) -> int:
+        """Insert a node in sorted order, returning its index"""
+        key = node.position.sort_key()
+        insert_index = bisect.bisect_left(self._keys, key)
+        self._keys.insert(insert_index, key)
+        self.nodes.insert(insert_index, node)
+        if node.visible:
+            self._show(node)
+        return insert_index
+    
+    def _show(self, node: CRDTNode):
+        """Add a node to the visible index"""
+        key = node.position.sort_key()
+        index = bisect.bisect_left(self._visible_keys, key)
+        self._visible_keys.insert(index, key)
+        self._visible_nodes.insert(index, node)
+        self._visible_count += 1
+    
+    def _hide(self, node: CRDTNode):
+        """Remove a node from the visible index"""
+        self._hide_at(bisect.bisect_left(self._visible_keys, node.position.sort_key()))
+    
+    def _hide_at(self, index: int) -> CRDTNode:
+        """Hide the index-th visible node without scanning the sequence"""
+        node = self._visible_nodes.pop(index)
+        del self._visible_keys[index]
+        self._visible_count -= 1
+        node.visible = False
+        return node
+    
+    def _set_visible(self, node: CRDTNode, visible: bool):
+        """Update a stored node's visibility and the visible index"""
+        if node.visible == visible:
+            return
+        node.visible = visible
+        if visible:
+            self._show(node)
+        else:
+            self._hide(node)
+    
+    def _rebuild_visible_index(self):
+        """Recompute the visible index from self.nodes"""
+        self._visible_nodes = [node for node in self.nodes if node.visible]
+        self._visible_keys = [node.position.sort_key() for node in self._visible_nodes]
+        self._visible_count = len(self._visible_nodes)
+    
+    def _find_node(self, position: Position) -> Optional[CRDTNode]:
+        """Find the node stored at exactly this position"""
+        key = position.sort_key()
+        index = bisect.bisect_left(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key:
+            return self.nodes[index]
+        return None
+    
+    def _allocate_between(self, left_id: int, right_id: int, depth: int) -> int:
+        """
+        Pick an identifier strictly between left_id and right_id (LSEQ).
+        
+        Even depths allocate close to the left bound and odd depths close to
+        the right one, so both appending and prepending leave room at the
+        same depth instead of pushing identifiers ever deeper.
+        """
+        step = self._rng.getrandbits(16) % min(right_id - left_id - 1, self.BOUNDARY) + 1
+        if depth % 2 == 0:
+            return left_id + step
+        return right_id - step
     
     def _generate_position_between(self, pos1: Position, pos2: Position) -> Position:
         """Generate a position between two existing positions"""
         self.clock += 1
-        
-        # Find the depth where positions differ
+
+        left_ids = pos1.identifiers
+        right_ids = pos2.identifiers
+
+        # Fast path: room at the top level, as when typing into an open gap
+        if left_ids and right_ids and right_ids[0] - left_ids[0] > 1:
+            new_id = self._allocate_between(left_ids[0], right_ids[0], 0)
+            return Position([new_id], f"{self.site_id}_{self.clock}")
+
+        new_identifiers = []
+        # While the new prefix still equals pos2's prefix, pos2 bounds the
+        # next level; once it is strictly smaller, any larger id will do
+        bounded = True
         depth = 0
-        while (depth < len(pos1.identifiers) and 
-               depth < len(pos2.identifiers) and
-               pos1.identifiers[depth] == pos2.identifiers[depth]):
-            depth += 1
         
-        # Create new identifier list
-        new_identifiers = pos1.identifiers[:depth].copy()
-        
-        if depth < len(pos1.identifiers) and depth < len(pos2.identifiers):
-            # Both positions have identifiers at this depth
-            left_id = pos1.identifiers[depth]
-            right_id = pos2.identifiers[depth]
+        while True:
+            left_id = left_ids[depth] if depth < len(left_ids) else 0
+            if bounded and depth < len(right_ids):
+                right_id = right_ids[depth]
+            else:
+                right_id = self.MAX_IDENTIFIER
+                bounded = False
             
             if right_id - left_id > 1:
                 # There's space between the identifiers
-                new_id = random.randint(left_id + 1, right_id - 1)
-                new_identifiers.append(new_id)
-            else:
-                # No space, need to go deeper
-                new_identifiers.append(left_id)
-                if depth + 1 < len(pos1.identifiers):
-                    # Use next level from pos1
-                    new_identifiers.extend(pos1.identifiers[depth + 1:])
-                
-                # Add a new random identifier
-                new_identifiers.append(random.randint(1, 2**16))
-        
-        elif depth < len(pos1.identifiers):
-            # Only pos1 has identifier at this depth
-            new_identifiers.extend(pos1.identifiers[depth:])
-            new_identifiers.append(random.randint(1, 2**16))
-        
-        elif depth < len(pos2.identifiers):
-            # Only pos2 has identifier at this depth
-            right_id = pos2.identifiers[depth]
-            if right_id > 1:
-                new_id = random.randint(1, right_id - 1)
-                new_identifiers.append(new_id)
-            else:
-                new_identifiers.append(0)
-                new_identifiers.append(random.randint(1, 2**16))
-        
-        else:
-            # Both positions end at the same depth
-            new_identifiers.append(random.randint(1, 2**16))
+                new_identifiers.append(self._allocate_between(left_id, right_id, depth))
+                break
+            
+            # No space, need to go deeper
+            new_identifiers.append(left_id)
+            if left_id < right_id:
+                bounded = False
+            depth += 1
         
         return Position(new_identifiers, f"{self.site_id}_{self.clock}")
     
@@ -94,7 +159,7 @@ class SequenceCRDT:
             raise ValueError(f"Index {index} out of bounds")
         
         # Find the positions to insert between
-        visible_nodes = [node for node in self.nodes if node.visible]
+        visible_nodes = self._visible_nodes
         
         if index == 0:
             # Insert at beginning
@@ -114,21 +179,17 @@ class SequenceCRDT:
         new_node = CRDTNode(new_position, value, visible=True)
         
         # Insert node in sorted order
-        insert_index = bisect.bisect_left(self.nodes, new_node)
-        self.nodes.insert(insert_index, new_node)
+        self._insert_node(new_node)
         
         return CRDTOperation('insert', new_node, self.site_id)
     
     def local_delete(self, index: int) -> CRDTOperation:
         """Delete a character at the given index"""
-        visible_nodes = [node for node in self.nodes if node.visible]
-        
-        if index < 0 or index >= len(visible_nodes):
+        if index < 0 or index >= self._visible_count:
             raise ValueError(f"Index {index} out of bounds")
         
         # Find the node to delete
-        node_to_delete = visible_nodes[index]
-        node_to_delete.visible = False
+        node_to_delete = self._hide_at(index)
         
         return CRDTOperation('delete', node_to_delete, self.site_id)
     
@@ -144,36 +205,34 @@ class SequenceCRDT:
     def _apply_remote_insert(self, node: CRDTNode) -> bool:
         """Apply a remote insert operation"""
         # Check if node already exists
-        for existing_node in self.nodes:
-            if existing_node.position == node.position:
-                # Node already exists, update visibility
-                existing_node.visible = node.visible
-                return True
+        existing_node = self._find_node(node.position)
+        if existing_node is not None:
+            # Node already exists, update visibility
+            self._set_visible(existing_node, node.visible)
+            return True
         
         # Insert new node in sorted order
-        insert_index = bisect.bisect_left(self.nodes, node)
-        self.nodes.insert(insert_index, node)
+        self._insert_node(node)
         return True
     
     def _apply_remote_delete(self, node: CRDTNode) -> bool:
         """Apply a remote delete operation"""
         # Find and mark node as deleted
-        for existing_node in self.nodes:
-            if existing_node.position == node.position:
-                existing_node.visible = False
-                return True
+        existing_node = self._find_node(node.position)
+        if existing_node is not None:
+            self._set_visible(existing_node, False)
+            return True
         
         # Node not found - this shouldn't happen in a well-formed CRDT
         return False
     
     def get_text(self) -> str:
         """Get the current text content"""
-        visible_chars = [node.value for node in self.nodes if node.visible]
-        return ''.join(visible_chars)
+        return ''.join([node.value for node in self._visible_nodes])
     
     def get_visible_length(self) -> int:
         """Get the length of visible text"""
-        return sum(1 for node in self.nodes if node.visible)
+        return self._visible_count
     
     def to_dict(self) -> Dict[str, Any]:
         """Serialize CRDT state to dictionary"""
@@ -189,6 +248,8 @@ class SequenceCRDT:
         crdt = cls(data['site_id'])
         crdt.clock = data['clock']
         crdt.nodes = [CRDTNode.from_dict(node_data) for node_data in data['nodes']]
+        crdt._keys = [node.position.sort_key() for node in crdt.nodes]
+        crdt._rebuild_visible_index()
         return crdt
     
     def get_operations_since(self, timestamp: int) -> List[CRDTOperation]:
@@ -201,26 +262,49 @@ class SequenceCRDT:
         """Merge with another CRDT state"""
         operations = []
         
-        # Find nodes that exist in other but not in self
-        self_positions = {node.position for node in self.nodes}
+        # Both node lists are sorted by position, so walk them side by side
+        # and build the merged list in one pass
+        self_nodes, self_keys = self.nodes, self._keys
+        other_nodes, other_keys = other_crdt.nodes, other_crdt._keys
+        merged_nodes: List[CRDTNode] = []
+        merged_keys: List[Tuple[bytes, str]] = []
+        i = j = 0
         
-        for other_node in other_crdt.nodes:
-            if other_node.position not in self_positions:
-                # This is a new node, create insert operation
-                op = CRDTOperation('insert', other_node, other_crdt.site_id)
-                self.apply_remote(op)
-                operations.append(op)
-            else:
+        while j < len(other_nodes):
+            other_key = other_keys[j]
+            if i < len(self_nodes) and self_keys[i] < other_key:
+                merged_nodes.append(self_nodes[i])
+                merged_keys.append(self_keys[i])
+                i += 1
+                continue
+            
+            other_node = other_nodes[j]
+            j += 1
+            
+            if i < len(self_nodes) and self_keys[i] == other_key:
                 # Node exists, check if visibility changed
-                for self_node in self.nodes:
-                    if (self_node.position == other_node.position and 
-                        self_node.visible != other_node.visible):
-                        if other_node.visible:
-                            op = CRDTOperation('insert', other_node, other_crdt.site_id)
-                        else:
-                            op = CRDTOperation('delete', other_node, other_crdt.site_id)
-                        self.apply_remote(op)
-                        operations.append(op)
-                        break
-        
-        return operations
\ No newline at end of file
+                self_node = self_nodes[i]
+                if self_node.visible != other_node.visible:
+                    op_type = 'insert' if other_node.visible else 'delete'
+                    self_node.visible = other_node.visible
+                    operations.append(CRDTOperation(op_type, other_node, other_crdt.site_id))
+                merged_nodes.append(self_node)
+                merged_keys.append(other_key)
+                i += 1
+            else:
+                # This is a new node, create insert operation on a copy so the
+                # two replicas never share (and mutate) the same node object
+                node_copy = CRDTNode(other_node.position, other_node.value, other_node.visible)
+                operations.append(CRDTOperation('insert', node_copy, other_crdt.site_id))
+                merged_nodes.append(node_copy)
+                merged_keys.append(other_key)
+        
+        merged_nodes.extend(self_nodes[i:])
+        merged_keys.extend(self_keys[i:])
+        
+        if operations:
+            self.nodes = merged_nodes
+            self._keys = merged_keys
+            self._rebuild_visible_index()
+        
+        return operations
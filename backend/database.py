@@ -2,6 +2,7 @@
 Database configuration and session management
 """
 from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import QueuePool, NullPool
@@ -13,6 +14,63 @@ logger = logging.getLogger(__name__)
 # Database URL from environment variable
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./db.sqlite3")
 
+
+# Sync URL scheme -> async driver scheme used for the same database
+_ASYNC_SCHEMES = {
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+    "mysql+mysqldb": "mysql+aiomysql",
+}
+# Schemes that already name an async driver
+_ASYNC_DRIVERS = {"sqlite+aiosqlite", "postgresql+asyncpg", "mysql+aiomysql", "mysql+asyncmy"}
+
+
+def _async_database_url(url: str) -> str:
+    """Map a sync database URL onto the matching async driver"""
+    scheme, sep, rest = url.partition("://")
+    if sep and scheme in _ASYNC_DRIVERS:
+        return url
+    if sep and scheme in _ASYNC_SCHEMES:
+        return f"{_ASYNC_SCHEMES[scheme]}://{rest}"
+    raise ValueError(
+        f"No async driver known for database URL scheme '{scheme}'; "
+        "set ASYNC_DATABASE_URL to an async SQLAlchemy URL for this database"
+    )
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_database_url(DATABASE_URL)
+
+
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    """Configure SQLite for better concurrent access"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA page_size=8192")  # Only takes effect on a new database, before WAL
+    cursor.execute("PRAGMA journal_mode=WAL")  # Write-Ahead Logging
+    cursor.execute("PRAGMA synchronous=NORMAL")  # Better performance
+    cursor.execute("PRAGMA busy_timeout=5000")  # 5 second timeout
+    cursor.execute("PRAGMA temp_store=MEMORY")  # Use memory for temp tables
+    cursor.execute("PRAGMA mmap_size=268435456")  # Serve reads from a 256MB memory map
+    cursor.execute("PRAGMA cache_size=-65536")  # 64MB page cache
+    cursor.execute("PRAGMA wal_autocheckpoint=1000")  # Checkpoint every 1000 pages
+    cursor.close()
+
+
+# Compiled SQL cache entries per engine; the default of 500 is easily
+# churned by the ORM's many lazy-load and relationship statements
+QUERY_CACHE_SIZE = 1200
+
+# Connection pool sizing for server databases (per process)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "30"))
+DB_POOL_OVERFLOW = int(os.getenv("DB_POOL_OVERFLOW", "60"))
+# Milliseconds before PostgreSQL cancels a statement holding a pooled connection
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "5000"))
+
+
 # Create engine with proper pooling configuration
 if DATABASE_URL.startswith("sqlite"):
     # SQLite doesn't benefit from connection pooling
@@ -20,33 +78,69 @@ if DATABASE_URL.startswith("sqlite"):
         DATABASE_URL, 
         connect_args={"check_same_thread": False},
         echo=False,
+        query_cache_size=QUERY_CACHE_SIZE,
         poolclass=NullPool  # No connection pooling for SQLite
     )
     
     # Configure SQLite for better concurrent access
-    @event.listens_for(engine, "connect")
-    def set_sqlite_pragma(dbapi_connection, connection_record):
-        cursor = dbapi_connection.cursor()
-        cursor.execute("PRAGMA journal_mode=WAL")  # Write-Ahead Logging
-        cursor.execute("PRAGMA synchronous=NORMAL")  # Better performance
-        cursor.execute("PRAGMA busy_timeout=5000")  # 5 second timeout
-        cursor.execute("PRAGMA temp_store=MEMORY")  # Use memory for temp tables
-        cursor.close()
+    event.listen(engine, "connect", _set_sqlite_pragma)
 else:
     # For PostgreSQL, MySQL, etc.
+    connect_args = {}
+    if DATABASE_URL.startswith(("postgresql", "postgres:")):
+        connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT}"
+        # TCP keepalives notice dead connections without a ping per checkout
+        connect_args.update(keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3)
     engine = create_engine(
         DATABASE_URL, 
         echo=False,
+        query_cache_size=QUERY_CACHE_SIZE,
+        connect_args=connect_args,
         poolclass=QueuePool,
-        pool_size=20,  # Number of connections to maintain
-        max_overflow=40,  # Maximum overflow connections
+        pool_size=DB_POOL_SIZE,  # Number of connections to maintain
+        max_overflow=DB_POOL_OVERFLOW,  # Maximum overflow connections
         pool_timeout=30,  # Timeout for getting connection from pool
-        pool_recycle=3600,  # Recycle connections after 1 hour
-        pool_pre_ping=True  # Verify connections before using
+        pool_recycle=600,  # Recycle connections well before server idle timeouts
+        pool_pre_ping=False,  # Keepalives and disconnect handling replace a SELECT 1 per checkout
+        pool_use_lifo=True  # Reuse warm connections; idle extras can time out
     )
 
-# Create session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Async engine for request paths that run on the event loop
+if ASYNC_DATABASE_URL.startswith("sqlite"):
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        echo=False,
+        query_cache_size=QUERY_CACHE_SIZE,
+        poolclass=NullPool
+    )
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragma)
+else:
+    async_connect_args = {}
+    if ASYNC_DATABASE_URL.startswith("postgresql+asyncpg"):
+        async_connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT)}
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        echo=False,
+        query_cache_size=QUERY_CACHE_SIZE,
+        connect_args=async_connect_args,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_POOL_OVERFLOW,
+        pool_timeout=30,
+        pool_recycle=600,
+        pool_pre_ping=False,
+        pool_use_lifo=True
+    )
+
+# Create session factories
+# Objects stay loaded after commit, so responses need no refresh
+# round-trip; columns the server fills in must be set explicitly instead
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, expire_on_commit=False)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
 
 # Base class for models
 Base = declarative_base()
@@ -61,7 +155,22 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    """Dependency to get an async database session"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 def create_tables():
     """Create all tables"""
     import models
-    models.Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as connection:
+            connection.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    models.Base.metadata.create_all(bind=engine)
+    
+    if DATABASE_URL.startswith("sqlite"):
+        with engine.connect() as connection:
+            mmap_size = connection.exec_driver_sql("PRAGMA mmap_size").scalar()
+            page_size = connection.exec_driver_sql("PRAGMA page_size").scalar()
+        logger.info(f"SQLite mmap_size={mmap_size} page_size={page_size}")
\ No newline at end of file
@@ -1,41 +1,64 @@
 """
 FastAPI main application for the collaborative Markdown editor
 """
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, Request
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
+from fastapi.responses import ORJSONResponse
+from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 import os
-import json
+import orjson
+import atexit
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import queue
 import sys
-import models
 import auth
-from database import get_db, create_tables
+from database import AsyncSessionLocal, create_tables
+from rate_limit import limiter
+from queries import document_access_check
+import access_cache
 from routers import users, documents
+from spa import mount_frontend
 from optimized_ws_manager import optimized_manager as manager
 
-# Configure logging
+# Configure logging. Records are formatted where they are logged and
+# written by a listener thread, so a slow terminal or disk never blocks
+# the event loop
+_log_queue = queue.SimpleQueue()
+_log_listener = QueueListener(
+    _log_queue,
+    logging.StreamHandler(sys.stdout),
+    # delay: workers that never log don't open the file
+    RotatingFileHandler('app.log', maxBytes=10_485_760, backupCount=5, delay=True)
+)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('app.log')
-    ]
+    handlers=[QueueHandler(_log_queue)]
 )
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
-# Create rate limiter
-limiter = Limiter(
-    key_func=get_remote_address,
-    default_limits=["200 per minute", "50 per second"],
-    storage_uri="memory://",
-)
+__all__ = ["app"]
+
+
+# Largest WebSocket message accepted from clients
+MAX_MESSAGE_SIZE = 1_048_576  # 1MB
+
+
+def _j(obj) -> str:
+    """Serialize a WebSocket reply with orjson"""
+    return orjson.dumps(obj).decode()
+
+
+# Constant error replies, serialized once at import
+_ERR_TOO_LARGE = _j({"type": "error", "message": "Message too large (max 1MB)"})
+_ERR_INVALID_FORMAT = _j({"type": "error", "message": "Invalid message format"})
+_ERR_INVALID_JSON = _j({"type": "error", "message": "Invalid JSON format"})
+_ERR_CONNECTION = _j({"type": "error", "message": "Connection error occurred"})
+
 
 # Create FastAPI app
 app = FastAPI(
@@ -43,7 +66,9 @@ app = FastAPI(
     description="A modern, real-time collaborative Markdown editor with CRDT",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    # Responses are encoded with orjson instead of the stdlib json module
+    default_response_class=ORJSONResponse
 )
 
 # Add rate limiter to app
@@ -77,6 +102,7 @@ async def startup_event():
     logger.info("Starting application...")
     create_tables()
     logger.info("Database tables created successfully")
+    await manager.start_fanout()
     logger.info("Background tasks started")
 
 @app.on_event("shutdown")
@@ -88,15 +114,10 @@ async def shutdown_event():
         cleanup_task.cancel()
         logger.info("Cleanup task cancelled")
     # Save all pending documents
-    from database import SessionLocal
-    db = SessionLocal()
-    try:
-        logger.info(f"Saving {len(manager.document_crdts)} pending documents...")
-        for doc_id in list(manager.document_crdts.keys()):
-            await manager._save_document_state(doc_id, db)
-        logger.info("All documents saved successfully")
-    finally:
-        db.close()
+    logger.info(f"Saving {len(manager.document_crdts)} pending documents...")
+    await manager._save_documents(list(manager.document_crdts.keys()), snapshot=True)
+    logger.info("All documents saved successfully")
+    await manager.stop_fanout()
 
 # Health check endpoint
 @app.get("/health")
@@ -124,89 +145,120 @@ async def root():
 async def websocket_endpoint(
     websocket: WebSocket,
     document_id: str,
-    token: str = None,
-    db: Session = Depends(get_db)
+    token: str = None
 ):
     """WebSocket endpoint for real-time document collaboration"""
-    logger.info(f"WebSocket connection attempt for document: {document_id}, token: {token[:20] if token else 'None'}...")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("WebSocket connection attempt for document: %s, token: %s...",
+                     document_id, token[:20] if token else None)
     user = None
+    username = None
     
     # Authenticate user if token provided
     if token:
         try:
             # Remove "Bearer " prefix if present (in case it's passed from header format)
             clean_token = token.replace("Bearer ", "") if token.startswith("Bearer ") else token
-            logger.debug(f"Cleaned token: {clean_token[:20] if clean_token else 'None'}...")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Cleaned token: %s...", clean_token[:20] if clean_token else None)
             
             token_data = auth.verify_token(clean_token)
-            logger.debug(f"Token verification result: {token_data}")
+            logger.debug("Token verification result: %s", token_data)
             if token_data and not token_data.username.startswith("guest_"):
-                user = auth.get_user_by_username(db, token_data.username)
-                logger.info(f"Found user: {user.username if user else 'None'}")
+                username = token_data.username
+                user = auth.get_cached_user(username)
         except Exception as e:
-            logger.warning(f"Token verification error: {e}")
+            logger.warning("Token verification error: %s", e)
             pass  # Allow guest access
     
-    # Check if document exists and user has access
-    document = db.query(models.Document).filter(
-        models.Document.id == document_id
-    ).first()
+    # Only open a session when the caches can't answer, so rejected and
+    # repeat connections never take a connection from the pool
+    db = None
+    try:
+        if username and user is None:
+            db = AsyncSessionLocal()
+            user = await auth.get_user_by_username_async(db, username)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Found user: %s", user.username if user else None)
+        
+        # Check if document exists and user has access, from cache or in one round-trip
+        user_id = user.id if user else None
+        access = access_cache.get_access(document_id, user_id)
+        if access is None:
+            if db is None:
+                db = AsyncSessionLocal()
+            result = await db.execute(
+                document_access_check,
+                {"doc_id": document_id, "uid": user_id}
+            )
+            row = result.first()
+            if row is not None:
+                access = access_cache.set_access(document_id, user_id, row)
+    except Exception as e:
+        logger.error(f"WebSocket handshake error for document {document_id}: {e}", exc_info=True)
+        await websocket.close(code=1011, reason="Server error")
+        return
+    finally:
+        if db is not None:
+            await db.close()
     
-    logger.info(f"Document found: {document is not None}, is_public: {document.is_public if document else 'N/A'}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Document found: %s, is_public: %s",
+                     access is not None, access.is_public if access else None)
     
-    if not document:
+    if not access:
         logger.warning("Document not found, closing connection")
         await websocket.close(code=4004, reason="Document not found")
         return
     
     # Check access permissions
-    if not document.is_public and not user:
+    if not access.is_public and not user:
         logger.warning("Authentication required for private document")
         await websocket.close(code=4003, reason="Authentication required")
         return
     
-    if not document.is_public and user and document.owner_id != user.id:
-        # Check if user is a collaborator
-        collaborator = db.query(models.DocumentCollaborator).filter(
-            models.DocumentCollaborator.document_id == document_id,
-            models.DocumentCollaborator.user_id == user.id
-        ).first()
-        
-        if not collaborator:
-            logger.warning(f"Access denied for user {user.username if user else 'None'}")
-            await websocket.close(code=4003, reason="Access denied")
-            return
+    if not access.is_public and access.owner_id != user.id and access.user_id is None:
+        logger.warning("Access denied for user %s", user.username)
+        await websocket.close(code=4003, reason="Access denied")
+        return
     
     try:
         # Connect to the document room
-        await manager.connect(websocket, document_id, user, db)
+        await manager.connect(websocket, document_id, user)
         
         # Handle messages
         while True:
             try:
-                message = await websocket.receive_text()
-                # Validate message size (limit to 1MB)
-                if len(message) > 1_048_576:  # 1MB
-                    await websocket.send_text(json.dumps({
-                        "type": "error",
-                        "message": "Message too large (max 1MB)"
-                    }))
+                # Take the raw frame so binary frames are never decoded to str
+                event = await websocket.receive()
+                if event["type"] == "websocket.disconnect":
+                    break
+                message = event.get("bytes") or event.get("text")
+                if not message:
+                    continue
+                # Validate message size (limit to 1MB); uvicorn's ws_max_size
+                # already drops larger frames before they are buffered
+                if len(message) > MAX_MESSAGE_SIZE:
+                    await manager.send(websocket, _ERR_TOO_LARGE)
+                    continue
+                
+                data = orjson.loads(message)
+                # orjson only ever returns exact dicts for objects
+                if type(data) is not dict:
+                    await manager.send(websocket, _ERR_INVALID_FORMAT)
                     continue
                 
-                await manager.handle_message(websocket, message, db)
+                await manager.handle_message(websocket, data)
             except WebSocketDisconnect:
                 break
-            except json.JSONDecodeError:
-                await websocket.send_text(json.dumps({
-                    "type": "error",
-                    "message": "Invalid JSON format"
-                }))
+            except orjson.JSONDecodeError:
+                await manager.send(websocket, _ERR_INVALID_JSON)
             except Exception as e:
                 logger.error(f"Error handling WebSocket message: {e}", exc_info=True)
                 
                 # Send error message to client
                 try:
-                    await websocket.send_text(json.dumps({
+                    await manager.send(websocket, _j({
                         "type": "error",
                         "message": f"Error processing message: {str(e)}"
                     }))
@@ -221,35 +273,18 @@ async def websocket_endpoint(
         
         # Try to send error before closing
         try:
-            await websocket.send_text(json.dumps({
-                "type": "error",
-                "message": "Connection error occurred"
-            }))
+            await manager.send(websocket, _ERR_CONNECTION)
         except:
             pass
     finally:
         # Disconnect from the document room
         try:
-            await manager.disconnect(websocket, db)
+            await manager.disconnect(websocket)
         except Exception as e:
             logger.error(f"Error during disconnect: {e}", exc_info=True)
 
 # Serve frontend static files in production
-if os.path.exists("../frontend/build"):
-    app.mount("/assets", StaticFiles(directory="../frontend/build/assets"), name="assets")
-    
-    @app.get("/{full_path:path}")
-    async def serve_frontend(full_path: str):
-        """Serve frontend application"""
-        # Serve index.html for all routes (SPA)
-        if full_path.startswith("api/") or full_path.startswith("ws/") or full_path.startswith("docs") or full_path.startswith("redoc"):
-            raise HTTPException(status_code=404, detail="Not found")
-        
-        file_path = f"../frontend/build/{full_path}"
-        if os.path.exists(file_path) and os.path.isfile(file_path):
-            return FileResponse(file_path)
-        else:
-            return FileResponse("../frontend/build/index.html")
+mount_frontend(app)
 
 if __name__ == "__main__":
     import uvicorn
@@ -257,6 +292,21 @@ if __name__ == "__main__":
         "main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        # C-accelerated event loop and HTTP parser, from uvicorn[standard]
+        loop="uvloop",
+        http="httptools",
+        ws="websockets",
+        # Rooms live in process memory: more than one worker splits the
+        # collaborators of a document unless broadcasts are fanned out
+        workers=int(os.getenv("WORKERS", "1")),
+        reload=os.getenv("RELOAD", "false").lower() == "true",
+        ws_max_size=MAX_MESSAGE_SIZE,
+        # Compresses large frames such as initial_state in C, with the
+        # websockets defaults capping per-connection zlib memory
+        ws_per_message_deflate=True,
+        # Keepalive uses WebSocket ping control frames, answered below the
+        # JSON layer; a peer that misses a pong is disconnected
+        ws_ping_interval=20.0,
+        ws_ping_timeout=20.0,
         log_level="info"
     )
\ No newline at end of file
@@ -0,0 +1,55 @@
+"""
+One-off migration of documents.crdt_state from JSON text to compressed blobs
+
+Run once from the backend directory after upgrading:
+
+    python migrate_crdt_state.py
+"""
+import logging
+from sqlalchemy import text, bindparam, LargeBinary
+from database import engine
+from crdt.codec import encode_crdt, decode_crdt
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def migrate():
+    """Re-encode every legacy JSON crdt_state row"""
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            # Text to bytea keeps the JSON bytes; they are re-encoded below
+            conn.execute(text(
+                "ALTER TABLE documents ALTER COLUMN crdt_state TYPE BYTEA "
+                "USING convert_to(crdt_state, 'UTF8')"
+            ))
+            rows = conn.execute(text(
+                "SELECT id, crdt_state FROM documents WHERE crdt_state IS NOT NULL"
+            ))
+        else:
+            # SQLite keeps the legacy values with TEXT storage class
+            rows = conn.execute(text(
+                "SELECT id, crdt_state FROM documents "
+                "WHERE crdt_state IS NOT NULL AND typeof(crdt_state) = 'text'"
+            ))
+
+        update = text(
+            "UPDATE documents SET crdt_state = :state WHERE id = :id"
+        ).bindparams(bindparam("state", type_=LargeBinary))
+
+        migrated = 0
+        for doc_id, state in rows.fetchall():
+            if isinstance(state, (bytes, bytearray, memoryview)) and bytes(state)[:1] != b"{":
+                continue  # Already compressed
+            try:
+                decoded = decode_crdt(state)
+                conn.execute(update, {"id": doc_id, "state": encode_crdt(decoded) if decoded else None})
+                migrated += 1
+            except ValueError as e:
+                logger.error(f"Skipping document {doc_id}: {e}")
+
+        logger.info(f"Migrated {migrated} document(s)")
+
+
+if __name__ == "__main__":
+    migrate()
@@ -1,19 +1,42 @@
 """
 SQLAlchemy models for the collaborative editor
 """
-from sqlalchemy import Column, String, Text, DateTime, Boolean, ForeignKey, Integer
+from sqlalchemy import Column, String, DateTime, Boolean, ForeignKey, Integer, Index, LargeBinary, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql import func
+import os
+import time
 import uuid
+from datetime import datetime
 
 Base = declarative_base()
 
 
+def uuid7() -> str:
+    """
+    Time-ordered UUIDv7 (RFC 9562) string.
+
+    Keeps the 36-character format of uuid4 ids, but consecutive ids sort
+    together, so inserts append to the primary key B-tree instead of
+    splitting pages at random.
+    """
+    timestamp_ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (
+        (timestamp_ms & 0xFFFF_FFFF_FFFF) << 80
+        | 0x7 << 76                            # version
+        | ((rand >> 62) & 0xFFF) << 64         # rand_a
+        | 0b10 << 62                           # variant
+        | (rand & 0x3FFF_FFFF_FFFF_FFFF)       # rand_b
+    )
+    return str(uuid.UUID(int=value))
+
+
 class User(Base):
     __tablename__ = "users"
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(String, primary_key=True, default=uuid7)
     username = Column(String(50), unique=True, nullable=False, index=True)
     email = Column(String(100), unique=True, nullable=True, index=True)
     hashed_password = Column(String(255), nullable=False)
@@ -27,11 +50,28 @@ class User(Base):
 
 class Document(Base):
     __tablename__ = "documents"
+    __table_args__ = (
+        # Partial index: only public documents are looked up by visibility
+        Index(
+            "ix_doc_public", "is_public",
+            postgresql_where=text("is_public"),
+            sqlite_where=text("is_public")
+        ),
+        # Trigram index for the substring name search; needs pg_trgm,
+        # which create_tables enables
+        Index(
+            "ix_doc_name_trgm", "name",
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"}
+        ).ddl_if(dialect="postgresql"),
+    )
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(String, primary_key=True, default=uuid7)
     name = Column(String(255), nullable=False)
-    crdt_state = Column(Text, nullable=True)  # JSON serialized CRDT state
-    owner_id = Column(String, ForeignKey("users.id"), nullable=True)  # Nullable for guest documents
+    # Compressed CRDT state, see crdt.codec; deferred so listings and
+    # permission checks never read the blob
+    crdt_state = deferred(Column(LargeBinary, nullable=True))
+    owner_id = Column(String, ForeignKey("users.id"), nullable=True, index=True)  # Nullable for guest documents
     is_public = Column(Boolean, default=False)
     word_count = Column(Integer, default=0)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -44,6 +84,9 @@ class Document(Base):
 
 class DocumentCollaborator(Base):
     __tablename__ = "document_collaborators"
+    __table_args__ = (
+        Index("ix_collab_doc_user", "document_id", "user_id", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     document_id = Column(String, ForeignKey("documents.id"), nullable=False)
@@ -58,8 +101,18 @@ class DocumentCollaborator(Base):
 
 class DocumentSession(Base):
     __tablename__ = "document_sessions"
+    __table_args__ = (
+        # Partial index: only active sessions are listed per document, and
+        # they are a small fraction of the rows kept for history
+        Index(
+            "ix_session_doc_active", "document_id",
+            postgresql_where=text("is_active"),
+            sqlite_where=text("is_active")
+        ),
+        Index("ix_session_last_seen", "last_seen"),
+    )
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(String, primary_key=True, default=uuid7)
     document_id = Column(String, ForeignKey("documents.id"), nullable=False)
     user_id = Column(String, ForeignKey("users.id"), nullable=True)  # Nullable for guest users
     session_id = Column(String(255), nullable=False)  # WebSocket session ID
@@ -70,4 +123,17 @@ class DocumentSession(Base):
     
     # Relationships
     document = relationship("Document")
-    user = relationship("User")
\ No newline at end of file
+    user = relationship("User")
+
+
+class DocumentOperation(Base):
+    """Append-only log of CRDT operations applied since the last snapshot"""
+    __tablename__ = "document_operations"
+    __table_args__ = (
+        Index("ix_docop_doc_id", "document_id", "id"),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    document_id = Column(String, ForeignKey("documents.id"), nullable=False)
+    operation = Column(LargeBinary, nullable=False)  # orjson-encoded operation
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)  # UTC
@@ -1,59 +1,171 @@
 """
 Optimized WebSocket connection manager with better memory management
 """
-from typing import Dict, Set, Optional, List
+from typing import Dict, Set, Optional, List, Tuple, Union
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
-import json
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.orm import undefer
+import orjson
 import asyncio
+import itertools
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
-from collections import defaultdict
-import gzip
-import base64
+import os
+import sys
+import time
+from collections import defaultdict, OrderedDict
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Only needed to fan out across several workers
+    aioredis = None
 
 import models
 from crdt.optimized_crdt import OptimizedSequenceCRDT
-from database import get_db
+from crdt.codec import encode_crdt, decode_crdt
+from database import AsyncSessionLocal
 
 logger = logging.getLogger(__name__)
 
+
+# Snapshots are compressed here, off the event loop; zlib releases the
+# GIL while it works. JSON parsing holds the GIL, so it stays inline
+_cpu_pool = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="ws-cpu")
+
+# Set to fan broadcasts out to every worker over Redis pub/sub
+REDIS_URL = os.getenv("REDIS_URL")
+# Each document's peer traffic goes to CHANNEL_PREFIX + document_id
+CHANNEL_PREFIX = "doc:"
+
+
+def _dumps(obj) -> str:
+    """Serialize a message for a text frame"""
+    return orjson.dumps(obj).decode()
+
+
+def _encode_snapshot(state, text: str) -> Tuple[bytes, int]:
+    """Encode a CRDT snapshot and count the words of its text, off the loop"""
+    return encode_crdt(state), len(text.split())
+
+
+@dataclass(slots=True)
+class ConnectionInfo:
+    """What the manager keeps about one WebSocket connection"""
+    document_id: str
+    user: Optional[models.User]
+    site_id: str
+    connected_at: int  # time.monotonic_ns()
+    # Body of the user_joined/user_left frames
+    identity: str
+
+
+# Constant frames, serialized once at import
+_PONG = _dumps({"type": "pong"})
+_REFRESH_REQUIRED = _dumps({"type": "refresh_required"})
+_ERR_NOT_INITIALIZED = _dumps({"type": "error", "message": "Document not initialized"})
+_ERR_APPLY_FAILED = _dumps({"type": "error", "message": "Failed to apply operation"})
+_ERR_LOAD_FAILED = _dumps({"type": "error", "message": "Failed to load document"})
+
 class OptimizedConnectionManager:
     """Optimized WebSocket connection manager"""
     
     def __init__(self):
         # Document ID -> Set of WebSocket connections
         self.active_connections: Dict[str, Set[WebSocket]] = defaultdict(set)
+        # Document ID -> tuple of its connections, for broadcasts to rooms
+        # too large to walk in one go; dropped whenever the room changes
+        self.room_snapshots: Dict[str, Tuple[WebSocket, ...]] = {}
+        # Size of every set in active_connections together
+        self.total_connections = 0
         # WebSocket -> Connection info
-        self.connection_info: Dict[WebSocket, Dict] = {}
-        # Document ID -> CRDT instance (limited cache)
-        self.document_crdts: Dict[str, OptimizedSequenceCRDT] = {}
-        # Document ID -> Last save timestamp
-        self.last_save_times: Dict[str, datetime] = {}
+        self.connection_info: Dict[WebSocket, ConnectionInfo] = {}
+        # Document ID -> CRDT instance (limited cache, least recently used first)
+        self.document_crdts: "OrderedDict[str, OptimizedSequenceCRDT]" = OrderedDict()
+        # Document ID -> time.monotonic_ns() of its last unsaved change;
+        # each entry is a pending save
+        self.last_save_times: Dict[str, int] = {}
         # Save debounce delay in seconds
         self.save_delay = 5.0
-        # Track active save tasks
-        self.save_tasks: Dict[str, asyncio.Task] = {}
+        # One task saves every due document together, in one transaction
+        self.save_writer: Optional[asyncio.Task] = None
+        self.save_wakeup = asyncio.Event()
         # Connection pool limits
         self.max_connections_per_document = 50
         self.max_total_connections = 500
         # CRDT cache limits
         self.max_cached_crdts = 20
         self.max_crdt_size = 1_048_576  # 1MB
+        # Document ID -> queued (websocket, operation) items
+        self.operation_queues: Dict[str, asyncio.Queue] = {}
+        # Document ID -> task applying queued operations in batches
+        self.operation_workers: Dict[str, asyncio.Task] = {}
+        # Operations arriving within this window are applied as one batch
+        self.coalesce_window = 0.005
+        self.max_batch_size = 256
+        # WebSocket -> pending outbound messages and the task sending them
+        self.outbound_queues: Dict[WebSocket, asyncio.Queue] = {}
+        self.writer_tasks: Dict[WebSocket, asyncio.Task] = {}
+        # A client this far behind is dropped instead of buffered without bound
+        self.max_outbound_queue = 256
+        # Queued messages are merged into frames of up to this many characters
+        self.max_frame_size = 65536
+        # Broadcasts to larger rooms yield to the event loop between batches
+        self.broadcast_batch_size = 50
+        # Document ID -> (log_id, op_counter, frame) of the last initial_state
+        # sent, so a burst of joiners shares one serialization
+        self.initial_state_cache: Dict[str, Tuple[str, int, str]] = {}
+        # Document ID -> encoded operations applied here but not yet logged
+        self.unsaved_operations: Dict[str, List[bytes]] = {}
+        # Document ID -> operations logged since the last full snapshot
+        self.logged_since_snapshot: Dict[str, int] = {}
+        # Saves append to the operation log; every this many operations
+        # the full state is rewritten instead
+        self.snapshot_interval = 1000
+        # Logged operations older than this are in every worker's state,
+        # so a new snapshot makes them redundant
+        self.oplog_retention = timedelta(seconds=60)
+        # Document ID -> lock serializing loads of that document's CRDT
+        self.init_locks: Dict[str, asyncio.Lock] = {}
+        # Dropped slow connections, disconnected off the broadcast path
+        self.cleanup_queue: Optional[asyncio.Queue] = None
+        self.cleanup_task: Optional[asyncio.Task] = None
+        # Cross-worker fan-out, started by start_fanout() when Redis is set
+        self.instance_id = uuid.uuid4().hex
+        # Site IDs are unique per worker by the counter, and across workers
+        # and restarts by the instance prefix
+        self.site_counter = itertools.count()
+        self.redis = None
+        self.fanout_tasks: List[asyncio.Task] = []
+        self.publish_queue: Optional[asyncio.Queue] = None
+        # Document ID -> operations from peers that arrived while loading
+        self.pending_remote_ops: Dict[str, List[dict]] = {}
+        # Document ID -> future resolved by a peer's state snapshot
+        self.state_waiters: Dict[str, asyncio.Future] = {}
+        # How long a worker loading a document waits for a peer's snapshot
+        self.peer_state_timeout = 0.25
+        # Message type -> handler taking (websocket, data)
+        self._dispatch = {
+            "operation": self._handle_operation,
+            "ping": self._handle_ping,
+            "request_state": self._send_current_state,
+        }
         
     async def connect(
         self, 
         websocket: WebSocket, 
         document_id: str, 
-        user: Optional[models.User],
-        db: Session
+        user: Optional[models.User]
     ):
         """Accept a new WebSocket connection with limits"""
+        # Every connection to a document then shares one key object, so
+        # per-message dict lookups match it by identity
+        document_id = sys.intern(document_id)
         try:
             # Check connection limits
-            total_connections = sum(len(conns) for conns in self.active_connections.values())
-            if total_connections >= self.max_total_connections:
+            if self.total_connections >= self.max_total_connections:
                 await websocket.close(code=4008, reason="Server at capacity")
                 return
             
@@ -62,160 +174,310 @@ class OptimizedConnectionManager:
                 return
             
             await websocket.accept()
-            logger.info(f"WebSocket accepted for document {document_id}")
+            logger.debug("WebSocket accepted for document %s", document_id)
             
-            # Add connection
+            # Add connection and its writer
             self.active_connections[document_id].add(websocket)
+            self.room_snapshots.pop(document_id, None)
+            self.total_connections += 1
+            self._start_writer(websocket)
             
             # Generate site ID
-            site_id = f"{user.id if user else 'guest'}_{uuid.uuid4().hex[:8]}"
+            site_id = f"{user.id if user else 'guest'}_{self.instance_id[:8]}{next(self.site_counter):x}"
+            
+            # Body of the user_joined/user_left frames, serialized once;
+            # each frame prepends its type field
+            identity = _dumps({
+                "user_id": user.id if user else None,
+                "username": user.username if user else "Guest",
+                "site_id": site_id
+            })[1:]
             
             # Store connection info
-            self.connection_info[websocket] = {
-                "document_id": document_id,
-                "user": user,
-                "site_id": site_id,
-                "connected_at": datetime.utcnow()
-            }
+            self.connection_info[websocket] = ConnectionInfo(
+                document_id=document_id,
+                user=user,
+                site_id=site_id,
+                connected_at=time.monotonic_ns(),
+                identity=identity
+            )
             
             # Initialize CRDT
-            await self._initialize_document_crdt(document_id, site_id, db)
+            await self._initialize_document_crdt(document_id, site_id)
             
             # Send initial state (compressed if large)
             await self._send_initial_state(websocket, document_id)
             
             # Notify others
-            await self._broadcast_user_joined(document_id, user, site_id, exclude=websocket)
+            await self._broadcast_user_joined(document_id, identity, exclude=websocket)
             
-            logger.info(f"Connection established for document {document_id}")
+            logger.info("Connection established for document %s", document_id)
             
         except Exception as e:
             logger.error(f"Connection error: {e}")
             await websocket.close(code=4000, reason="Connection error")
     
-    async def disconnect(self, websocket: WebSocket, db: Session):
+    async def disconnect(self, websocket: WebSocket):
         """Handle WebSocket disconnection"""
         try:
-            if websocket not in self.connection_info:
+            # Taken up front, so a second disconnect of the same connection
+            # (receive loop and cleanup worker) returns at once
+            info = self.connection_info.pop(websocket, None)
+            if info is None:
                 return
             
-            info = self.connection_info[websocket]
-            document_id = info["document_id"]
-            user = info["user"]
-            site_id = info["site_id"]
+            document_id = info.document_id
             
             # Remove connection
-            self.active_connections[document_id].discard(websocket)
+            connections = self.active_connections[document_id]
+            if websocket in connections:
+                connections.discard(websocket)
+                self.room_snapshots.pop(document_id, None)
+                self.total_connections -= 1
+            self._stop_writer(websocket)
             
             # Clean up empty document connections
             if not self.active_connections[document_id]:
                 del self.active_connections[document_id]
-                # Save final state
-                await self._save_document_state(document_id, db)
-                # Cancel pending save task
-                if document_id in self.save_tasks:
-                    self.save_tasks[document_id].cancel()
-                    del self.save_tasks[document_id]
+                # Apply anything still queued before the final save
+                await self._stop_operation_worker(document_id)
+                # Save final state, which covers any pending save
+                self.last_save_times.pop(document_id, None)
+                await self._save_document_state(document_id, snapshot=True)
                 # Remove from cache if it's getting too large
                 if document_id in self.document_crdts:
+                    # Recency counts from the last edit, not the first join
+                    self.document_crdts.move_to_end(document_id)
                     crdt = self.document_crdts[document_id]
                     if crdt.get_state_size() > self.max_crdt_size:
                         del self.document_crdts[document_id]
-            
-            # Remove connection info
-            del self.connection_info[websocket]
+                        self.initial_state_cache.pop(document_id, None)
             
             # Notify others
-            await self._broadcast_user_left(document_id, user, site_id)
+            await self._broadcast_user_left(document_id, info.identity)
             
-            logger.info(f"Connection closed for document {document_id}")
+            logger.info("Connection closed for document %s", document_id)
             
         except Exception as e:
             logger.error(f"Disconnect error: {e}")
     
-    async def handle_message(self, websocket: WebSocket, message: str, db: Session):
-        """Handle incoming WebSocket message"""
+    def _start_writer(self, websocket: WebSocket):
+        """Give a connection its outbound queue and writer task"""
+        queue = asyncio.Queue(maxsize=self.max_outbound_queue)
+        self.outbound_queues[websocket] = queue
+        self.writer_tasks[websocket] = asyncio.create_task(self._writer(websocket, queue))
+    
+    def _stop_writer(self, websocket: WebSocket):
+        """Let a connection's writer flush what is queued, then stop"""
+        queue = self.outbound_queues.pop(websocket, None)
+        task = self.writer_tasks.pop(websocket, None)
+        if queue is None or task is None:
+            return
+        try:
+            queue.put_nowait(None)
+        except asyncio.QueueFull:
+            task.cancel()
+    
+    async def _writer(self, websocket: WebSocket, queue: asyncio.Queue):
+        """Send queued messages, merging a backlog into fewer frames"""
+        try:
+            while True:
+                message = await queue.get()
+                if message is None:
+                    return
+                
+                messages = [message]
+                size = len(message)
+                stop = False
+                while size < self.max_frame_size and not queue.empty():
+                    message = queue.get_nowait()
+                    if message is None:
+                        stop = True
+                        break
+                    messages.append(message)
+                    size += len(message)
+                
+                # Records are separated by U+001E, which JSON never contains
+                await websocket.send_text("\x1e".join(messages))
+                if stop:
+                    return
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"Failed to send message: {e}")
+    
+    def _enqueue(self, websocket: WebSocket, message: str) -> bool:
+        """Queue a message for a connection; False if it cannot keep up"""
+        queue = self.outbound_queues.get(websocket)
+        if queue is None:
+            return False
+        try:
+            queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+    
+    async def send(self, websocket: WebSocket, message: str):
+        """Send a message to one connection through its writer"""
+        if websocket not in self.outbound_queues:
+            await websocket.send_text(message)
+        elif not self._enqueue(websocket, message):
+            logger.warning("Outbound queue full, dropping message")
+    
+    async def handle_message(self, websocket: WebSocket, data: dict):
+        """Dispatch a parsed WebSocket message on its type"""
         try:
-            # Parse message
-            data = json.loads(message)
             msg_type = data.get("type")
             
-            if msg_type == "operation":
-                await self._handle_operation(websocket, data, db)
-            elif msg_type == "ping":
-                await websocket.send_text(json.dumps({"type": "pong"}))
-            elif msg_type == "request_state":
-                await self._send_current_state(websocket)
+            handler = self._dispatch.get(msg_type)
+            if handler is not None:
+                await handler(websocket, data)
             else:
                 logger.warning(f"Unknown message type: {msg_type}")
         
-        except json.JSONDecodeError:
-            logger.error("Invalid JSON message")
         except Exception as e:
             logger.error(f"Message handling error: {e}")
     
-    async def _handle_operation(self, websocket: WebSocket, data: dict, db: Session):
+    async def _handle_ping(self, websocket: WebSocket, data: dict):
+        """Answer a client keepalive"""
+        await self.send(websocket, _PONG)
+    
+    async def _handle_operation(self, websocket: WebSocket, data: dict):
         """Handle CRDT operation"""
         try:
             info = self.connection_info[websocket]
-            document_id = info["document_id"]
+            document_id = info.document_id
             
             if document_id not in self.document_crdts:
-                await websocket.send_text(json.dumps({
-                    "type": "error",
-                    "message": "Document not initialized"
-                }))
+                await self.send(websocket, _ERR_NOT_INITIALIZED)
                 return
             
-            crdt = self.document_crdts[document_id]
-            operation = data.get("operation")
+            # Queue for the document's worker, which coalesces bursts
+            queue = self.operation_queues.get(document_id)
+            if queue is None:
+                queue = asyncio.Queue()
+                self.operation_queues[document_id] = queue
+                self.operation_workers[document_id] = asyncio.create_task(
+                    self._operation_worker(document_id, queue)
+                )
+            queue.put_nowait((websocket, data.get("operation")))
+        
+        except Exception as e:
+            logger.error(f"Operation handling error: {e}")
+    
+    async def _operation_worker(self, document_id: str, queue: asyncio.Queue):
+        """Apply queued operations for a document in coalesced batches"""
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
             
-            # Apply operation
-            if crdt.apply_remote(operation):
-                # Broadcast to others
-                await self._broadcast_operation(document_id, operation, exclude=websocket)
-                
-                # Schedule save
-                self._schedule_save(document_id, db)
-                
-                # Check CRDT size
-                if crdt.get_state_size() > self.max_crdt_size:
-                    logger.warning(f"Document {document_id} exceeding size limit")
-                    await self._compact_document(document_id, db)
-            else:
-                await websocket.send_text(json.dumps({
-                    "type": "error",
-                    "message": "Failed to apply operation"
-                }))
+            # Give a typing burst a moment to arrive, then take it all at once
+            await asyncio.sleep(self.coalesce_window)
+            batch = [item]
+            stop = False
+            while len(batch) < self.max_batch_size and not queue.empty():
+                item = queue.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            
+            await self._apply_operation_batch(document_id, batch)
+            if stop:
+                return
+    
+    async def _apply_operation_batch(self, document_id: str, batch: List[tuple]):
+        """Apply a batch of operations, then save and size-check once"""
+        try:
+            crdt = self.document_crdts.get(document_id)
+            applied = []
+            
+            for websocket, operation in batch:
+                # Apply operation
+                if crdt is not None and crdt.apply_remote(operation):
+                    self.unsaved_operations.setdefault(document_id, []).append(orjson.dumps(operation))
+                    applied.append((websocket, operation))
+                else:
+                    try:
+                        await self.send(websocket, _ERR_APPLY_FAILED)
+                    except Exception as e:
+                        logger.warning(f"Failed to send message: {e}")
+            
+            if not applied:
+                return
+            
+            # Broadcast the whole batch to others at once
+            await self._broadcast_operations(document_id, applied)
+            
+            # Schedule save
+            self._schedule_save(document_id)
+            
+            # Check CRDT size
+            if crdt.get_state_size() > self.max_crdt_size:
+                logger.warning(f"Document {document_id} exceeding size limit")
+                await self._compact_document(document_id)
         
         except Exception as e:
             logger.error(f"Operation handling error: {e}")
     
-    async def _initialize_document_crdt(self, document_id: str, site_id: str, db: Session):
+    async def _stop_operation_worker(self, document_id: str):
+        """Let a document's worker drain its queue, then stop it"""
+        queue = self.operation_queues.pop(document_id, None)
+        worker = self.operation_workers.pop(document_id, None)
+        if queue is None or worker is None:
+            return
+        
+        queue.put_nowait(None)
+        if worker is not asyncio.current_task():
+            await worker
+    
+    async def _initialize_document_crdt(self, document_id: str, site_id: str):
         """Initialize or load CRDT for document"""
+        # Loading can wait on peers, so two connections must not load at once
+        lock = self.init_locks.setdefault(document_id, asyncio.Lock())
+        try:
+            async with lock:
+                await self._load_document_crdt(document_id, site_id)
+        finally:
+            if not lock.locked():
+                self.init_locks.pop(document_id, None)
+    
+    async def _load_document_crdt(self, document_id: str, site_id: str):
+        """Load a document's CRDT from a peer worker or the database"""
         try:
-            # Check cache limit
-            if len(self.document_crdts) >= self.max_cached_crdts:
-                # Remove least recently used
-                oldest_id = next(iter(self.document_crdts))
-                await self._save_document_state(oldest_id, db)
-                del self.document_crdts[oldest_id]
-            
             if document_id in self.document_crdts:
+                self.document_crdts.move_to_end(document_id)
                 return
             
-            # Load from database
-            document = db.query(models.Document).filter(
-                models.Document.id == document_id
-            ).first()
+            if len(self.document_crdts) >= self.max_cached_crdts:
+                await self._evict_idle_crdt()
+            
+            # Read the snapshot, including the deferred blob, and the
+            # operations logged since; the session closes before any wait
+            async with AsyncSessionLocal() as db:
+                document = await db.get(
+                    models.Document, document_id,
+                    options=[undefer(models.Document.crdt_state)]
+                )
+                if not document:
+                    raise ValueError(f"Document {document_id} not found")
+                logged = (await db.execute(
+                    select(models.DocumentOperation.operation)
+                    .where(models.DocumentOperation.document_id == document_id)
+                    .order_by(models.DocumentOperation.id)
+                )).scalars().all()
             
-            if not document:
-                raise ValueError(f"Document {document_id} not found")
+            # A worker already editing the document has newer state than
+            # its last save
+            peer_state = await self._request_peer_state(document_id)
             
             # Initialize CRDT
-            if document.crdt_state:
+            if peer_state is not None:
+                crdt = OptimizedSequenceCRDT.from_dict(peer_state)
+            elif document.crdt_state:
                 try:
-                    crdt_data = json.loads(document.crdt_state)
+                    crdt_data = decode_crdt(document.crdt_state)
                     crdt = OptimizedSequenceCRDT.from_dict(crdt_data)
                 except Exception as e:
                     logger.error(f"Failed to load CRDT state: {e}")
@@ -223,55 +485,91 @@ class OptimizedConnectionManager:
             else:
                 crdt = OptimizedSequenceCRDT(site_id)
             
+            if peer_state is None:
+                # Replay operations logged since the snapshot; entries the
+                # snapshot already contains are no-ops
+                for blob in logged:
+                    crdt.apply_remote(orjson.loads(blob))
+            
+            # Catch up on peer operations that arrived while loading
+            for operation in self.pending_remote_ops.pop(document_id, ()):
+                crdt.apply_remote(operation)
+            
             self.document_crdts[document_id] = crdt
             
         except Exception as e:
             logger.error(f"CRDT initialization error: {e}")
             raise
+        finally:
+            self.pending_remote_ops.pop(document_id, None)
+    
+    async def _evict_idle_crdt(self):
+        """Save and drop the least recently used CRDT nobody is editing"""
+        # Documents with connections must stay loaded, so the cache can
+        # briefly run over its limit when every cached document is in use
+        for victim_id in self.document_crdts:
+            if victim_id not in self.active_connections:
+                break
+        else:
+            return
+        
+        await self._save_document_state(victim_id, snapshot=True)
+        # Someone may have reopened it while it was being saved
+        if victim_id not in self.active_connections:
+            self.document_crdts.pop(victim_id, None)
+            self.initial_state_cache.pop(victim_id, None)
     
     async def _send_initial_state(self, websocket: WebSocket, document_id: str):
-        """Send initial document state (compressed if needed)"""
+        """Send initial document state; the WebSocket layer compresses it"""
         try:
             if document_id not in self.document_crdts:
                 return
             
             crdt = self.document_crdts[document_id]
-            state_dict = crdt.to_dict()
-            state_json = json.dumps(state_dict)
+            # Any edit bumps op_counter and a reloaded CRDT has a new log_id
+            cached = self.initial_state_cache.get(document_id)
+            if cached is not None and cached[0] == crdt.log_id and cached[1] == crdt.op_counter:
+                await self.send(websocket, cached[2])
+                return
             
-            # Compress if large
-            if len(state_json) > 10240:  # 10KB
-                compressed = gzip.compress(state_json.encode())
-                encoded = base64.b64encode(compressed).decode()
-                
-                await websocket.send_text(json.dumps({
-                    "type": "initial_state",
-                    "document_id": document_id,
-                    "compressed": True,
-                    "data": encoded,
-                    "text": crdt.get_text()[:1000]  # Send first 1000 chars for quick display
-                }))
-            else:
-                await websocket.send_text(json.dumps({
-                    "type": "initial_state",
-                    "document_id": document_id,
-                    "compressed": False,
-                    "crdt_state": state_dict,
-                    "text": crdt.get_text()
-                }))
+            # Splice in the CRDT's cached JSON, which periodic saves reuse too,
+            # rather than serializing the state again
+            frame = b"".join((
+                b'{"type":"initial_state","document_id":', orjson.dumps(document_id),
+                b',"crdt_state":', crdt.to_json(),
+                b',"op_counter":', orjson.dumps(crdt.op_counter),
+                b',"log_id":', orjson.dumps(crdt.log_id),
+                b',"text":', orjson.dumps(crdt.get_text()),
+                b'}',
+            )).decode()
+            # Nothing above yields, so the counter still matches the frame
+            self.initial_state_cache[document_id] = (crdt.log_id, crdt.op_counter, frame)
+            await self.send(websocket, frame)
                 
         except Exception as e:
             logger.error(f"Failed to send initial state: {e}")
-            await websocket.send_text(json.dumps({
-                "type": "error",
-                "message": "Failed to load document"
-            }))
+            await self.send(websocket, _ERR_LOAD_FAILED)
     
-    async def _send_current_state(self, websocket: WebSocket):
-        """Send current state on request"""
+    async def _send_current_state(self, websocket: WebSocket, data: dict):
+        """Send current state on request, as a delta when the client is close behind"""
         try:
             info = self.connection_info[websocket]
-            document_id = info["document_id"]
+            document_id = info.document_id
+            
+            since = data.get("since")
+            crdt = self.document_crdts.get(document_id)
+            if crdt is not None and isinstance(since, int):
+                operations = crdt.get_delta_since(since, data.get("log_id"))
+                if operations is not None:
+                    await self.send(websocket, _dumps({
+                        "type": "delta",
+                        "document_id": document_id,
+                        "since": since,
+                        "op_counter": crdt.op_counter,
+                        "operations": operations
+                    }))
+                    return
+            
             await self._send_initial_state(websocket, document_id)
         except Exception as e:
             logger.error(f"Failed to send current state: {e}")
@@ -283,131 +581,447 @@ class OptimizedConnectionManager:
         exclude: Optional[WebSocket] = None
     ):
         """Broadcast operation to all connections"""
-        message = json.dumps({
+        message = _dumps({
             "type": "operation",
             "operation": operation
         })
         
-        await self._broadcast_message(document_id, message, exclude)
+        await self._broadcast_message(document_id, message, exclude, operation)
+    
+    async def _broadcast_operations(self, document_id: str, applied: List[tuple]):
+        """Broadcast a batch of (sender, operation) pairs, one frame per recipient"""
+        # A lone editor never gets their own operations back, so with no
+        # peer workers there is nobody to encode anything for
+        room = self.active_connections.get(document_id)
+        if self.publish_queue is None and (
+            not room or (len(room) == 1 and all(websocket in room for websocket, _ in applied))
+        ):
+            return
+        
+        if len(applied) == 1:
+            websocket, operation = applied[0]
+            await self._broadcast_operation(document_id, operation, exclude=websocket)
+            return
+        
+        operations = [operation for _, operation in applied]
+        message = _dumps({"type": "operation_batch", "ops": operations})
+        self._publish(document_id, "message", message=message, operations=operations)
+        
+        # Senders never get their own operations back, so each one that is
+        # still here gets a frame of everybody else's
+        senders = {websocket for websocket, _ in applied}
+        await self._deliver_local(document_id, message, exclude=senders)
+        for sender in senders:
+            others = [operation for websocket, operation in applied if websocket is not sender]
+            if others and sender in self.outbound_queues:
+                await self.send(sender, _dumps({"type": "operation_batch", "ops": others}))
     
     async def _broadcast_user_joined(
         self, 
         document_id: str, 
-        user: Optional[models.User], 
-        site_id: str,
+        identity: str,
         exclude: Optional[WebSocket] = None
     ):
         """Broadcast user joined event"""
-        message = json.dumps({
-            "type": "user_joined",
-            "user_id": user.id if user else None,
-            "username": user.username if user else "Guest",
-            "site_id": site_id
-        })
-        
-        await self._broadcast_message(document_id, message, exclude)
+        await self._broadcast_message(document_id, '{"type":"user_joined",' + identity, exclude)
+    
+    async def _broadcast_user_left(self, document_id: str, identity: str):
+        """Broadcast user left event"""
+        await self._broadcast_message(document_id, '{"type":"user_left",' + identity)
     
-    async def _broadcast_user_left(
+    async def _broadcast_message(
         self, 
         document_id: str, 
-        user: Optional[models.User], 
-        site_id: str
+        message: str, 
+        exclude: Optional[WebSocket] = None,
+        operation: Optional[dict] = None
     ):
-        """Broadcast user left event"""
-        message = json.dumps({
-            "type": "user_left",
-            "user_id": user.id if user else None,
-            "username": user.username if user else "Guest",
-            "site_id": site_id
-        })
-        
-        await self._broadcast_message(document_id, message)
+        """Broadcast to this worker's connections and to peer workers"""
+        self._publish(document_id, "message", message=message, operation=operation)
+        await self._deliver_local(document_id, message, exclude)
     
-    async def _broadcast_message(
+    async def _deliver_local(
         self, 
         document_id: str, 
         message: str, 
-        exclude: Optional[WebSocket] = None
+        exclude: Optional[Union[WebSocket, Set[WebSocket]]] = None
     ):
-        """Broadcast message to all connections"""
+        """Deliver one encoded message, shared by every local connection's queue"""
         if document_id not in self.active_connections:
             return
         
-        broken_connections = []
+        excluded = exclude if type(exclude) is set else {exclude}
+        room = self.active_connections[document_id]
+        batch_size = self.broadcast_batch_size
+        if len(room) <= batch_size:
+            # Nothing below yields, so the room can be walked in place
+            batches = (room,)
+        else:
+            # Snapshot: the room may change while this yields. Rebuilt
+            # only after a join or leave, not per message
+            connections = self.room_snapshots.get(document_id)
+            if connections is None:
+                connections = self.room_snapshots[document_id] = tuple(room)
+            batches = (
+                connections[start:start + batch_size]
+                for start in range(0, len(connections), batch_size)
+            )
         
-        for connection in self.active_connections[document_id]:
-            if connection == exclude:
-                continue
-            
+        queues = self.outbound_queues
+        dropped = []
+        
+        for index, batch in enumerate(batches):
+            if index:
+                await asyncio.sleep(0)
+            for connection in batch:
+                if connection in excluded:
+                    continue
+                queue = queues.get(connection)
+                if queue is None:
+                    continue  # Disconnected while we yielded
+                try:
+                    queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    dropped.append(connection)
+        
+        for connection in dropped:
+            logger.warning("Outbound queue full, dropping slow connection")
+            self._drop_connection(connection)
+    
+    def _drop_connection(self, websocket: WebSocket):
+        """Hand a connection that missed messages to the cleanup worker"""
+        # Stop queueing to it now; the disconnect itself may save the
+        # document, which must not hold up the broadcast
+        self._stop_writer(websocket)
+        if self.cleanup_queue is None:
+            self.cleanup_queue = asyncio.Queue()
+            self.cleanup_task = asyncio.create_task(self._cleanup_worker(self.cleanup_queue))
+        self.cleanup_queue.put_nowait(websocket)
+    
+    async def _cleanup_worker(self, queue: asyncio.Queue):
+        """Disconnect dropped connections and let their clients reconnect"""
+        while True:
+            websocket = await queue.get()
             try:
-                await connection.send_text(message)
+                await self.disconnect(websocket)
+                await websocket.close(code=4010, reason="Client too slow")
             except Exception as e:
-                logger.warning(f"Failed to send message: {e}")
-                broken_connections.append(connection)
+                logger.debug("Cleanup of dropped connection failed: %s", e)
+    
+    async def start_fanout(self, redis_url: Optional[str] = REDIS_URL):
+        """Exchange broadcasts with other workers when Redis is configured"""
+        if not redis_url or self.redis is not None:
+            return
+        if aioredis is None:
+            logger.warning("REDIS_URL is set but the redis package is not installed")
+            return
         
-        # Clean up broken connections
-        if broken_connections:
-            from database import SessionLocal
-            db = SessionLocal()
+        self.redis = aioredis.from_url(redis_url, max_connections=64)
+        pubsub = self.redis.pubsub()
+        await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+        self.publish_queue = asyncio.Queue()
+        self.fanout_tasks = [
+            asyncio.create_task(self._fanout_listener(pubsub)),
+            asyncio.create_task(self._fanout_publisher(self.publish_queue)),
+        ]
+        logger.info("Broadcast fan-out enabled for worker %s", self.instance_id)
+    
+    async def stop_fanout(self):
+        """Stop exchanging broadcasts with other workers"""
+        for task in self.fanout_tasks:
+            task.cancel()
+        self.fanout_tasks = []
+        self.publish_queue = None
+        if self.redis is not None:
+            await self.redis.close()
+            self.redis = None
+    
+    def _publish(self, document_id: str, kind: str, **fields):
+        """Queue a message for peer workers; a no-op without fan-out"""
+        if self.publish_queue is None:
+            return
+        envelope = {"origin": self.instance_id, "kind": kind, "document_id": document_id}
+        envelope.update(fields)
+        self.publish_queue.put_nowait((document_id, orjson.dumps(envelope)))
+    
+    async def _fanout_publisher(self, queue: asyncio.Queue):
+        """Publish queued peer messages, pipelining a backlog"""
+        while True:
+            items = [await queue.get()]
+            while len(items) < self.max_batch_size and not queue.empty():
+                items.append(queue.get_nowait())
+            
             try:
-                for connection in broken_connections:
-                    await self.disconnect(connection, db)
-            finally:
-                db.close()
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for document_id, payload in items:
+                        pipe.publish(CHANNEL_PREFIX + document_id, payload)
+                    await pipe.execute()
+            except Exception as e:
+                logger.error(f"Fan-out publish error: {e}")
     
-    def _schedule_save(self, document_id: str, db: Session):
-        """Schedule document save with debouncing"""
-        self.last_save_times[document_id] = datetime.utcnow()
+    async def _fanout_listener(self, pubsub):
+        """Apply and deliver messages published by peer workers"""
+        try:
+            async for item in pubsub.listen():
+                if item.get("type") != "pmessage":
+                    continue
+                try:
+                    envelope = orjson.loads(item["data"])
+                except orjson.JSONDecodeError:
+                    continue
+                if envelope.get("origin") == self.instance_id:
+                    continue
+                await self._handle_peer_message(envelope)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Fan-out listener stopped: {e}")
+        finally:
+            await pubsub.close()
+    
+    async def _handle_peer_message(self, envelope: dict):
+        """Handle one message from another worker"""
+        document_id = envelope.get("document_id")
+        kind = envelope.get("kind")
+        
+        if kind == "state_request":
+            crdt = self.document_crdts.get(document_id)
+            if crdt is not None:
+                self._publish(document_id, "state", state=crdt.to_dict())
+            return
+        
+        if kind == "state":
+            waiter = self.state_waiters.get(document_id)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(envelope.get("state"))
+            return
         
-        # Cancel existing save task
-        if document_id in self.save_tasks:
-            self.save_tasks[document_id].cancel()
+        # Keep every cached copy current, even without local connections,
+        # so a later save or reconnect never works from stale state
+        operations = envelope.get("operations")
+        if operations is None and envelope.get("operation") is not None:
+            operations = [envelope["operation"]]
+        if operations:
+            pending = self.pending_remote_ops.get(document_id)
+            crdt = self.document_crdts.get(document_id)
+            if pending is not None:
+                pending.extend(operations)
+            elif crdt is not None:
+                for operation in operations:
+                    crdt.apply_remote(operation)
         
-        # Create new save task
-        task = asyncio.create_task(self._delayed_save(document_id, db))
-        self.save_tasks[document_id] = task
+        message = envelope.get("message")
+        if message:
+            await self._deliver_local(document_id, message)
     
-    async def _delayed_save(self, document_id: str, db: Session):
-        """Save document after delay"""
+    async def _request_peer_state(self, document_id: str) -> Optional[dict]:
+        """Ask peer workers for their copy of a document's state"""
+        if self.publish_queue is None:
+            return None
+        
+        self.pending_remote_ops[document_id] = []
+        waiter = asyncio.get_running_loop().create_future()
+        self.state_waiters[document_id] = waiter
+        self._publish(document_id, "state_request")
         try:
-            await asyncio.sleep(self.save_delay)
-            await self._save_document_state(document_id, db)
-        except asyncio.CancelledError:
-            pass
+            return await asyncio.wait_for(waiter, self.peer_state_timeout)
+        except asyncio.TimeoutError:
+            return None
         finally:
-            if document_id in self.save_tasks:
-                del self.save_tasks[document_id]
+            self.state_waiters.pop(document_id, None)
+    
+    def _schedule_save(self, document_id: str):
+        """Schedule document save with debouncing"""
+        self.last_save_times[document_id] = time.monotonic_ns()
+        
+        if self.save_writer is None or self.save_writer.done():
+            self.save_writer = asyncio.create_task(self._save_writer())
+        self.save_wakeup.set()
+    
+    async def _save_writer(self):
+        """Save documents once they have been quiet for save_delay, batching
+        every document due at the same time into one transaction"""
+        delay = int(self.save_delay * 1_000_000_000)
+        while True:
+            if not self.last_save_times:
+                self.save_wakeup.clear()
+                await self.save_wakeup.wait()
+                continue
+            
+            now = time.monotonic_ns()
+            due = [
+                document_id for document_id, changed_at in self.last_save_times.items()
+                if now - changed_at >= delay
+            ]
+            if not due:
+                # Sleep until the earliest pending save is due
+                await asyncio.sleep((min(self.last_save_times.values()) + delay - now) / 1e9)
+                continue
+            
+            for document_id in due:
+                del self.last_save_times[document_id]
+            await self._save_documents(due)
+    
+    async def _save_document_state(self, document_id: str, snapshot: bool = False):
+        """
+        Persist a document: log new operations, and rewrite the full state
+        when asked to or once enough operations have been logged.
+        """
+        await self._save_documents([document_id], snapshot)
     
-    async def _save_document_state(self, document_id: str, db: Session):
-        """Save current CRDT state to database"""
+    async def _save_documents(self, document_ids: List[str], snapshot: bool = False):
+        """Persist several documents, as _save_document_state, in one commit"""
+        popped = {
+            document_id: self.unsaved_operations.pop(document_id, [])
+            for document_id in document_ids
+        }
         try:
-            if document_id not in self.document_crdts:
-                return
+            now = datetime.utcnow()
+            loop = asyncio.get_running_loop()
             
-            crdt = self.document_crdts[document_id]
-            state_json = json.dumps(crdt.to_dict())
+            # Document ID -> (operations, state blob or None, word count)
+            writes = {}
+            for document_id, operations in popped.items():
+                logged = self.logged_since_snapshot.get(document_id, 0) + len(operations)
+                
+                state_blob = word_count = None
+                crdt = self.document_crdts.get(document_id)
+                if crdt is not None and (snapshot or logged >= self.snapshot_interval):
+                    # The cached JSON and text are immutable and taken
+                    # together, so the word count matches the state and
+                    # both are computed off the loop
+                    state_blob, word_count = await loop.run_in_executor(
+                        _cpu_pool, _encode_snapshot, crdt.to_json(), crdt.get_text()
+                    )
+                    if len(state_blob) > 5_242_880:  # 5MB
+                        logger.error(f"Document {document_id} too large to save")
+                        state_blob = None
+                elif crdt is not None and operations:
+                    # Listings read the stored count; keep it current between
+                    # snapshots
+                    word_count = len(crdt.get_text().split())
+                
+                if operations or state_blob is not None:
+                    writes[document_id] = (operations, state_blob, word_count)
             
-            # Check size
-            if len(state_json) > 5_242_880:  # 5MB
-                logger.error(f"Document {document_id} too large to save")
+            if not writes:
                 return
             
-            # Update database
-            document = db.query(models.Document).filter(
-                models.Document.id == document_id
-            ).first()
+            async with AsyncSessionLocal() as db:
+                # Documents deleted while still open: their operations have
+                # nothing to attach to, and would fail the whole batch
+                existing = set((await db.execute(
+                    select(models.Document.id).where(models.Document.id.in_(list(writes)))
+                )).scalars())
+            for document_id in [d for d in writes if d not in existing]:
+                logger.warning(f"Document {document_id} no longer exists, dropping its unsaved operations")
+                del writes[document_id]
+                self.logged_since_snapshot.pop(document_id, None)
+            if not writes:
+                return
             
-            if document:
-                document.crdt_state = state_json
-                document.updated_at = datetime.utcnow()
-                db.commit()
-                logger.info(f"Saved document {document_id}")
+            try:
+                snapshotted = await self._write_documents(writes, now)
+            except Exception as e:
+                if len(writes) == 1:
+                    raise
+                # One document's bad write must not cost the others theirs:
+                # retry each in its own transaction
+                logger.warning(f"Batched save failed, saving documents one at a time: {e}")
+                snapshotted = set()
+                for document_id, write in list(writes.items()):
+                    try:
+                        snapshotted |= await self._write_documents({document_id: write}, now)
+                    except Exception as e:
+                        logger.error(f"Save error for document {document_id}: {e}")
+                        del writes[document_id]
+                        self._retry_save(document_id, popped[document_id])
+            
+            for document_id, (operations, _, _) in writes.items():
+                if document_id in snapshotted:
+                    self.logged_since_snapshot[document_id] = 0
+                else:
+                    self.logged_since_snapshot[document_id] = (
+                        self.logged_since_snapshot.get(document_id, 0) + len(operations)
+                    )
+            logger.debug("Saved %d document(s)", len(writes))
                 
         except Exception as e:
             logger.error(f"Save error: {e}")
-            db.rollback()
+            for document_id, operations in popped.items():
+                self._retry_save(document_id, operations)
+    
+    async def _write_documents(self, writes: dict, now: datetime) -> Set[str]:
+        """
+        Write prepared (operations, state blob, word count) entries in one
+        transaction, returning the documents whose snapshot was written
+        """
+        snapshotted = set()
+        async with AsyncSessionLocal() as db:
+            rows = [
+                {"document_id": document_id, "operation": op, "created_at": now}
+                for document_id, (operations, _, _) in writes.items()
+                for op in operations
+            ]
+            if rows:
+                await db.execute(insert(models.DocumentOperation), rows)
+            
+            for document_id, (_, state_blob, word_count) in writes.items():
+                if state_blob is None:
+                    # Operations only: still mark the document as edited,
+                    # so listings sort it and count its words correctly
+                    values = {"updated_at": now}
+                    if word_count is not None:
+                        values["word_count"] = word_count
+                    await db.execute(
+                        update(models.Document)
+                        .where(models.Document.id == document_id)
+                        .values(**values)
+                    )
+                    continue
+                result = await db.execute(
+                    update(models.Document)
+                    .where(models.Document.id == document_id)
+                    .values(
+                        crdt_state=state_blob,
+                        word_count=word_count,
+                        updated_at=now
+                    )
+                )
+                if result.rowcount:
+                    await db.execute(
+                        delete(models.DocumentOperation).where(
+                            models.DocumentOperation.document_id == document_id,
+                            models.DocumentOperation.created_at < now - self.oplog_retention
+                        )
+                    )
+                    snapshotted.add(document_id)
+            
+            await db.commit()
+        return snapshotted
+    
+    def live_document_state(self, document_id: str) -> Optional[Tuple[bytes, int]]:
+        """
+        JSON state and word count of a document loaded on this worker, which
+        may be ahead of its last snapshot; None when it is not loaded
+        """
+        crdt = self.document_crdts.get(document_id)
+        if crdt is None:
+            return None
+        return crdt.to_json(), len(crdt.get_text().split())
+    
+    def _retry_save(self, document_id: str, operations: List[bytes]):
+        """Put a failed save's operations back and schedule another attempt"""
+        if operations:
+            self.unsaved_operations[document_id] = operations + self.unsaved_operations.get(document_id, [])
+        if document_id in self.unsaved_operations:
+            # An edit since keeps its own, later, due time
+            self.last_save_times.setdefault(document_id, time.monotonic_ns())
+            if self.save_writer is None or self.save_writer.done():
+                self.save_writer = asyncio.create_task(self._save_writer())
+            self.save_wakeup.set()
     
-    async def _compact_document(self, document_id: str, db: Session):
+    async def _compact_document(self, document_id: str):
         """Compact document CRDT to reduce size"""
         try:
             if document_id not in self.document_crdts:
@@ -417,12 +1031,12 @@ class OptimizedConnectionManager:
             crdt._compact()
             
             # Save compacted state
-            await self._save_document_state(document_id, db)
+            await self._save_document_state(document_id, snapshot=True)
             
             # Notify clients to refresh
             await self._broadcast_message(
                 document_id,
-                json.dumps({"type": "refresh_required"})
+                _REFRESH_REQUIRED
             )
             
         except Exception as e:
@@ -431,10 +1045,10 @@ class OptimizedConnectionManager:
     def get_stats(self) -> dict:
         """Get connection statistics"""
         return {
-            "total_connections": sum(len(conns) for conns in self.active_connections.values()),
+            "total_connections": self.total_connections,
             "active_documents": len(self.active_connections),
             "cached_crdts": len(self.document_crdts),
-            "pending_saves": len(self.save_tasks),
+            "pending_saves": len(self.last_save_times),
             "connections_by_document": {
                 doc_id: len(conns) 
                 for doc_id, conns in self.active_connections.items()
@@ -0,0 +1,31 @@
+"""
+Prebuilt SQL statements for hot request paths
+"""
+from sqlalchemy import select, and_, bindparam
+
+from models import Document, DocumentCollaborator
+
+
+def build_access_check():
+    """
+    Document visibility, owner and the caller's collaborator row in one query.
+
+    Bind with doc_id and uid (None for anonymous connections). Returns no
+    row when the document does not exist.
+    """
+    return (
+        select(Document.is_public, Document.owner_id, DocumentCollaborator.user_id)
+        .select_from(Document)
+        .outerjoin(
+            DocumentCollaborator,
+            and_(
+                DocumentCollaborator.document_id == Document.id,
+                DocumentCollaborator.user_id == bindparam("uid"),
+            ),
+        )
+        .where(Document.id == bindparam("doc_id"))
+        .limit(1)
+    )
+
+
+document_access_check = build_access_check()
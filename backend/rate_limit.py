@@ -0,0 +1,19 @@
+"""
+Rate limiter shared by the app and its routers
+"""
+import os
+from slowapi import Limiter
+from slowapi.util import get_remote_address
+
+# Counters live in Redis when it is configured, so every worker enforces
+# the same limits; otherwise each process counts on its own
+STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI") or os.getenv("REDIS_URL") or "memory://"
+
+# One instance, and so one storage client, per process. The moving window
+# counts the last minute exactly rather than resetting on the minute
+limiter = Limiter(
+    key_func=get_remote_address,
+    default_limits=["200 per minute", "50 per second"],
+    storage_uri=STORAGE_URI,
+    strategy="moving-window",
+)
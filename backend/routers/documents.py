@@ -1,47 +1,84 @@
 """
 Document management routes
 """
-from typing import List, Optional
+from typing import List, Optional, Tuple, Union
+from datetime import datetime, timezone
 from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+from sqlalchemy.orm import Session, undefer
+from sqlalchemy import or_, and_, func, exists, false
 import models
 import schemas
 import auth
+import access_cache
 from database import get_db
-import uuid
-import json
+from rate_limit import limiter
+from crdt.codec import decode_crdt
+from optimized_ws_manager import optimized_manager
 
 router = APIRouter(prefix="/api/docs", tags=["documents"])
-limiter = Limiter(key_func=get_remote_address)
 
 
-def calculate_word_count(crdt_state: Optional[str]) -> int:
-    """Calculate word count from CRDT state"""
+def calculate_word_count(crdt_state: Optional[Union[bytes, str]]) -> int:
+    """Calculate word count from a stored CRDT state"""
     if not crdt_state:
         return 0
     
     try:
-        crdt_data = json.loads(crdt_state)
-        if not crdt_data or 'nodes' not in crdt_data:
+        crdt_data = decode_crdt(crdt_state)
+        if not crdt_data:
             return 0
         
-        # Extract text from all non-deleted nodes
-        text_parts = []
-        for node in crdt_data['nodes'].values():
-            if node and not node.get('is_deleted', False):
-                text_parts.append(node.get('value', ''))
+        # Extract text from all visible nodes of either CRDT format
+        if 'sequence' in crdt_data:
+            text_parts = [node.get('char', '') for node in crdt_data['sequence']
+                          if node.get('visible', True)]
+        else:
+            text_parts = [node.get('value', '') for node in crdt_data.get('nodes', [])
+                          if node and node.get('visible', False)]
         
         # Join all text and count words
-        full_text = ''.join(text_parts)
-        words = full_text.strip().split()
-        return len([word for word in words if word])
+        return len(''.join(text_parts).split())
     except Exception:
         return 0
 
 
+def _fetch_doc_with_access(
+    db: Session,
+    document_id: str,
+    user: Optional[models.User],
+    *options
+) -> Tuple[Optional[models.Document], bool]:
+    """
+    Load a document and decide whether the user may read it, in one query.
+
+    Readable means public, owned by the user, or shared with them.
+    """
+    if user:
+        is_collaborator = exists().where(
+            models.DocumentCollaborator.document_id == document_id,
+            models.DocumentCollaborator.user_id == user.id
+        )
+    else:
+        is_collaborator = false()
+    
+    row = db.query(
+        models.Document, is_collaborator.label("is_collaborator")
+    ).options(*options).filter(
+        models.Document.id == document_id
+    ).first()
+    
+    if row is None:
+        return None, False
+    
+    document = row[0]
+    can_read = bool(
+        document.is_public
+        or (user and document.owner_id == user.id)
+        or row.is_collaborator
+    )
+    return document, can_read
+
+
 @router.get("/", response_model=schemas.DocumentList)
 async def list_documents(
     skip: int = Query(0, ge=0),
@@ -51,7 +88,9 @@ async def list_documents(
     db: Session = Depends(get_db)
 ):
     """List documents accessible to the current user"""
-    query = db.query(models.Document)
+    # The window count rides along with the page, so one round-trip
+    # returns both
+    query = db.query(models.Document, func.count().over().label("total"))
     
     if current_user:
         # Authenticated user: show owned documents and public documents
@@ -65,21 +104,26 @@ async def list_documents(
         # Guest user: show only public documents
         query = query.filter(models.Document.is_public == True)
     
-    # Apply search filter
+    # Apply search filter; served by the trigram index on PostgreSQL
     if search:
         query = query.filter(
             models.Document.name.ilike(f"%{search}%")
         )
     
-    # Get total count
-    total = query.count()
-    
     # Apply pagination and ordering
-    documents = query.order_by(
+    rows = query.order_by(
         models.Document.updated_at.desc()
     ).offset(skip).limit(limit).all()
     
-    return schemas.DocumentList(documents=documents, total=total)
+    if rows:
+        total = rows[0].total
+    elif skip:
+        # Past the last page: the window count has no row to ride on
+        total = query.with_entities(func.count()).order_by(None).scalar()
+    else:
+        total = 0
+    
+    return schemas.DocumentList(documents=[row[0] for row in rows], total=total)
 
 
 @router.post("/", response_model=schemas.Document, status_code=status.HTTP_201_CREATED)
@@ -105,16 +149,16 @@ async def create_document(
         )
     
     db_document = models.Document(
-        id=str(uuid.uuid4()),
+        id=models.uuid7(),
         name=document.name.strip(),
         owner_id=current_user.id if current_user else None,  # Guest users have no owner
         is_public=True if current_user is None else document.is_public,  # Guest documents are always public
-        crdt_state=None  # Will be initialized when first accessed
+        crdt_state=None,  # Will be initialized when first accessed
+        created_at=datetime.now(timezone.utc)
     )
     
     db.add(db_document)
     db.commit()
-    db.refresh(db_document)
     
     return db_document
 
@@ -126,9 +170,11 @@ async def get_document(
     db: Session = Depends(get_db)
 ):
     """Get a specific document"""
-    document = db.query(models.Document).filter(
-        models.Document.id == document_id
-    ).first()
+    # An open document's stored state lags its edits until the next
+    # snapshot, so serve the live CRDT when this worker has it
+    live = optimized_manager.live_document_state(document_id)
+    options = () if live else (undefer(models.Document.crdt_state),)
+    document, can_read = _fetch_doc_with_access(db, document_id, current_user, *options)
     
     if not document:
         raise HTTPException(
@@ -136,28 +182,19 @@ async def get_document(
             detail="Document not found"
         )
     
-    # Check access permissions
-    if not document.is_public:
-        if not current_user or document.owner_id != current_user.id:
-            # Check if user is a collaborator
-            if current_user:
-                collaborator = db.query(models.DocumentCollaborator).filter(
-                    and_(
-                        models.DocumentCollaborator.document_id == document_id,
-                        models.DocumentCollaborator.user_id == current_user.id
-                    )
-                ).first()
-                
-                if not collaborator:
-                    raise HTTPException(
-                        status_code=status.HTTP_403_FORBIDDEN,
-                        detail="Access denied"
-                    )
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="Access denied"
-                )
+    if not can_read:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied"
+        )
+    
+    if live is not None:
+        state, word_count = live
+        return schemas.DocumentWithContent(
+            **schemas.Document.model_validate(document).model_dump(exclude={"word_count"}),
+            word_count=word_count,
+            crdt_state=state.decode()
+        )
     
     return document
 
@@ -194,8 +231,9 @@ async def update_document(
     if document_update.is_public is not None:
         document.is_public = document_update.is_public
     
+    document.updated_at = datetime.now(timezone.utc)
     db.commit()
-    db.refresh(document)
+    access_cache.invalidate_document(document_id)
     
     return document
 
@@ -236,9 +274,14 @@ async def delete_document(
         models.DocumentSession.document_id == document_id
     ).delete()
     
+    db.query(models.DocumentOperation).filter(
+        models.DocumentOperation.document_id == document_id
+    ).delete()
+    
     # Delete document
     db.delete(document)
     db.commit()
+    access_cache.invalidate_document(document_id)
     
     return None
 
@@ -250,9 +293,7 @@ async def list_collaborators(
     db: Session = Depends(get_db)
 ):
     """List document collaborators"""
-    document = db.query(models.Document).filter(
-        models.Document.id == document_id
-    ).first()
+    document, can_read = _fetch_doc_with_access(db, document_id, current_user)
     
     if not document:
         raise HTTPException(
@@ -260,20 +301,11 @@ async def list_collaborators(
             detail="Document not found"
         )
     
-    # Check if user has access
-    if document.owner_id != current_user.id and not document.is_public:
-        collaborator = db.query(models.DocumentCollaborator).filter(
-            and_(
-                models.DocumentCollaborator.document_id == document_id,
-                models.DocumentCollaborator.user_id == current_user.id
-            )
-        ).first()
-        
-        if not collaborator:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Access denied"
-            )
+    if not can_read:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied"
+        )
     
     collaborators = db.query(models.DocumentCollaborator).filter(
         models.DocumentCollaborator.document_id == document_id
@@ -336,12 +368,13 @@ async def add_collaborator(
     db_collaborator = models.DocumentCollaborator(
         document_id=document_id,
         user_id=collaborator.user_id,
-        permission=collaborator.permission
+        permission=collaborator.permission,
+        created_at=datetime.now(timezone.utc)
     )
     
     db.add(db_collaborator)
     db.commit()
-    db.refresh(db_collaborator)
+    access_cache.invalidate_document(document_id)
     
     return db_collaborator
 
@@ -387,6 +420,7 @@ async def remove_collaborator(
     
     db.delete(collaborator)
     db.commit()
+    access_cache.invalidate_document(document_id)
     
     return None
 
@@ -398,9 +432,7 @@ async def list_active_sessions(
     db: Session = Depends(get_db)
 ):
     """List active sessions for a document"""
-    document = db.query(models.Document).filter(
-        models.Document.id == document_id
-    ).first()
+    document, can_read = _fetch_doc_with_access(db, document_id, current_user)
     
     if not document:
         raise HTTPException(
@@ -408,28 +440,11 @@ async def list_active_sessions(
             detail="Document not found"
         )
     
-    # Check access permissions
-    if not document.is_public:
-        if not current_user or document.owner_id != current_user.id:
-            # Check if user is a collaborator
-            if current_user:
-                collaborator = db.query(models.DocumentCollaborator).filter(
-                    and_(
-                        models.DocumentCollaborator.document_id == document_id,
-                        models.DocumentCollaborator.user_id == current_user.id
-                    )
-                ).first()
-                
-                if not collaborator:
-                    raise HTTPException(
-                        status_code=status.HTTP_403_FORBIDDEN,
-                        detail="Access denied"
-                    )
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="Access denied"
-                )
+    if not can_read:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied"
+        )
     
     # Get active sessions
     sessions = db.query(models.DocumentSession).filter(
@@ -4,17 +4,15 @@ User authentication and management routes
 from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import HTTPBearer
-from sqlalchemy.orm import Session
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+from sqlalchemy.ext.asyncio import AsyncSession
 import models
 import schemas
 import auth
-from database import get_db
+from database import get_async_db
+from rate_limit import limiter
 
 router = APIRouter(prefix="/api/users", tags=["users"])
 security = HTTPBearer()
-limiter = Limiter(key_func=get_remote_address)
 
 
 @router.post("/signup", response_model=schemas.User, status_code=status.HTTP_201_CREATED)
@@ -22,11 +20,11 @@ limiter = Limiter(key_func=get_remote_address)
 async def signup(
     request: Request,
     user: schemas.UserCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Register a new user"""
     try:
-        db_user = auth.create_user(db, user)
+        db_user = await auth.create_user(db, user)
         return db_user
     except HTTPException:
         raise
@@ -42,10 +40,10 @@ async def signup(
 async def login(
     request: Request,
     user_credentials: schemas.UserLogin,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Authenticate user and return access token"""
-    user = auth.authenticate_user(db, user_credentials.username, user_credentials.password)
+    user = await auth.authenticate_user(db, user_credentials.username, user_credentials.password)
     
     if not user:
         raise HTTPException(
@@ -69,7 +67,7 @@ async def login(
 
 @router.get("/me", response_model=schemas.User)
 async def get_current_user_info(
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: models.User = Depends(auth.get_current_active_user_async)
 ):
     """Get current user information"""
     return current_user
@@ -93,13 +91,13 @@ async def create_guest_token(request: Request):
 @router.put("/me", response_model=schemas.User)
 async def update_current_user(
     user_update: schemas.UserCreate,
-    current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(auth.get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update current user information"""
     # Check if new username is already taken (if different)
     if user_update.username != current_user.username:
-        existing_user = auth.get_user_by_username(db, user_update.username)
+        existing_user = await auth.get_user_by_username_async(db, user_update.username)
         if existing_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -108,7 +106,7 @@ async def update_current_user(
     
     # Check if new email is already taken (if different and provided)
     if user_update.email and user_update.email != current_user.email:
-        existing_user = auth.get_user_by_email(db, user_update.email)
+        existing_user = await auth.get_user_by_email_async(db, user_update.email)
         if existing_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -116,27 +114,32 @@ async def update_current_user(
             )
     
     # Update user
+    old_username = current_user.username
     current_user.username = user_update.username
     current_user.email = user_update.email
     
     # Update password if provided
     if user_update.password:
-        current_user.hashed_password = auth.get_password_hash(user_update.password)
+        current_user.hashed_password = await auth.get_password_hash_async(user_update.password)
     
-    db.commit()
-    db.refresh(current_user)
+    await db.commit()
+    # Only once committed: a request served while hashing or committing
+    # would otherwise cache the old row again
+    auth.invalidate_user_cache(old_username)
+    auth.invalidate_user_cache(current_user.username)
     
     return current_user
 
 
 @router.delete("/me", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_current_user(
-    current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(auth.get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Delete current user account"""
     # Mark user as inactive instead of deleting
     current_user.is_active = False
-    db.commit()
+    await db.commit()
+    auth.invalidate_user_cache(current_user.username)
     
     return None
\ No newline at end of file
@@ -1,9 +1,11 @@
 """
 Pydantic schemas for request/response validation
 """
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, field_validator
 from typing import Optional, List, Dict, Any
 from datetime import datetime
+import orjson
+from crdt.codec import decode_crdt
 
 
 # User schemas
@@ -26,8 +28,7 @@ class User(UserBase):
     is_active: bool
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class UserInDB(User):
@@ -56,12 +57,20 @@ class Document(DocumentBase):
     updated_at: Optional[datetime]
     word_count: Optional[int] = 0  # Make it optional with default 0
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class DocumentWithContent(Document):
     crdt_state: Optional[str] = None
+    
+    @field_validator('crdt_state', mode='before')
+    @classmethod
+    def decode_stored_state(cls, value):
+        """Clients still receive the CRDT state as a JSON string"""
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            state = decode_crdt(value)
+            return orjson.dumps(state).decode() if state is not None else None
+        return value
 
 
 class DocumentList(BaseModel):
@@ -116,8 +125,7 @@ class Collaborator(CollaboratorBase):
     created_at: datetime
     user: User
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # Session schemas
@@ -129,8 +137,7 @@ class DocumentSession(BaseModel):
     is_active: bool
     last_seen: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # Error schemas
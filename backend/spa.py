@@ -0,0 +1,39 @@
+"""
+Serving the built frontend single-page application
+"""
+import os
+from fastapi import FastAPI
+from fastapi.staticfiles import StaticFiles
+from starlette.exceptions import HTTPException as StarletteHTTPException
+
+__all__ = ["FRONTEND_BUILD_DIR", "SPAStaticFiles", "mount_frontend"]
+
+FRONTEND_BUILD_DIR = "../frontend/build"
+
+# Paths that belong to the API and must 404 rather than fall back to the app
+API_PREFIXES = ("api/", "ws/", "docs", "redoc")
+
+
+class SPAStaticFiles(StaticFiles):
+    """Static files with index.html as the fallback for client-side routes"""
+
+    async def get_response(self, path: str, scope):
+        try:
+            return await super().get_response(path, scope)
+        except StarletteHTTPException as e:
+            if e.status_code != 404 or path.startswith(API_PREFIXES):
+                raise
+            return await super().get_response("index.html", scope)
+
+
+def mount_frontend(app: FastAPI):
+    """
+    Serve the production frontend build, if there is one.
+
+    Must be called after every route is registered, since the mount
+    matches all remaining paths.
+    """
+    if not os.path.exists(FRONTEND_BUILD_DIR):
+        return
+
+    app.mount("/", SPAStaticFiles(directory=FRONTEND_BUILD_DIR, html=True), name="spa")
@@ -1,22 +1,72 @@
 """
 WebSocket connection manager for real-time collaboration
 """
-from typing import Dict, List, Set, Optional
+from typing import Dict, List, Set, Optional, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from fastapi import WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
-import json
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.orm import undefer
+import orjson
 import asyncio
+import itertools
+import os
+import sys
+import time
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 import models
 import schemas
 from crdt import SequenceCRDT, CRDTOperation
-from database import get_db
+from crdt.codec import encode_crdt, decode_crdt
+from database import AsyncSessionLocal
 from collections import OrderedDict
 import logging
 
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Only needed to fan out across several workers
+    aioredis = None
+
 logger = logging.getLogger(__name__)
 
+# Snapshots are encoded and compressed here, off the event loop; zlib
+# releases the GIL while it works. JSON parsing holds the GIL, so it
+# stays inline
+_cpu_pool = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="ws-cpu")
+
+# Set to fan broadcasts out to every worker over Redis pub/sub
+REDIS_URL = os.getenv("REDIS_URL")
+# Each document's peer traffic goes to CHANNEL_PREFIX + document_id
+CHANNEL_PREFIX = "doc:"
+
+# Constant error replies, serialized once at import
+_ERR_INVALID_JSON = orjson.dumps({"type": "error", "message": "Invalid JSON message"})
+_ERR_NOT_INITIALIZED = orjson.dumps({"type": "error", "message": "Document not initialized"})
+_ERR_APPLY_FAILED = orjson.dumps({"type": "error", "message": "Failed to apply operation"})
+
+
+def _encode_snapshot(state, text: str) -> Tuple[bytes, int]:
+    """Encode a CRDT snapshot and count the words of its text, off the loop"""
+    return encode_crdt(state), len(text.split())
+
+
+@dataclass(slots=True)
+class ConnectionInfo:
+    """What the manager keeps about one WebSocket connection"""
+    document_id: str
+    user: Optional[models.User]
+    site_id: str
+    connected_at: int  # time.monotonic_ns()
+    # site_id, user_id and username, merged into cursor and presence
+    # messages and sent in user_joined/user_left
+    identity: dict
+    # Outgoing (payload, urgent) items, drained by writer_task
+    out_queue: asyncio.Queue
+    writer_task: asyncio.Task
+    # Primary key of the connection's DocumentSession row, once written
+    session_pk: Optional[str] = None
+
 
 class LRUCache(OrderedDict):
     """Simple LRU cache implementation"""
@@ -25,17 +75,14 @@ class LRUCache(OrderedDict):
         super().__init__()
     
     def __setitem__(self, key, value):
-        if key in self:
-            self.move_to_end(key)
         super().__setitem__(key, value)
+        self.move_to_end(key)
         if len(self) > self.maxsize:
-            oldest = next(iter(self))
-            del self[oldest]
+            self.popitem(last=False)
     
     def __getitem__(self, key):
-        value = super().__getitem__(key)
         self.move_to_end(key)
-        return value
+        return super().__getitem__(key)
 
 
 class ConnectionManager:
@@ -45,65 +92,127 @@ class ConnectionManager:
         # Document ID -> Set of WebSocket connections
         self.active_connections: Dict[str, Set[WebSocket]] = {}
         # WebSocket -> Connection info
-        self.connection_info: Dict[WebSocket, Dict] = {}
+        self.connection_info: Dict[WebSocket, ConnectionInfo] = {}
         # Document ID -> CRDT instance (with LRU cache)
         self.document_crdts: LRUCache = LRUCache(maxsize=100)
-        # Document ID -> Last save timestamp
-        self.last_save_times: Dict[str, datetime] = {}
+        # Document ID -> encoded initial_state message, until the next edit
+        self.initial_state_cache: Dict[str, bytes] = {}
+        # Document ID -> lock serializing loads of that document's CRDT
+        self.init_locks: Dict[str, asyncio.Lock] = {}
+        # Document ID -> set while the document has unsaved changes
+        self.dirty: Dict[str, asyncio.Event] = {}
         # Save debounce delay in seconds
         self.save_delay = 3.0
-        # Track active save tasks
+        # Document ID -> encoded operations applied since the last save
+        self.unsaved_operations: Dict[str, List[bytes]] = {}
+        # Document ID -> operations logged since the last full snapshot
+        self.logged_since_snapshot: Dict[str, int] = {}
+        # Logged operations after which a save rewrites the full state
+        self.snapshot_interval = 1000
+        # Logged operations older than this predate the last snapshot,
+        # so a new snapshot makes them redundant
+        self.oplog_retention = timedelta(seconds=60)
+        # Document ID -> flusher task saving the document while it is open
         self.save_tasks: Dict[str, asyncio.Task] = {}
-        # Lock for connection cleanup
-        self.cleanup_lock = asyncio.Lock()
+        # Running disconnects of dropped connections, referenced until done
+        self.cleanup_tasks: Set[asyncio.Task] = set()
+        # Messages a connection may have waiting before it counts as too slow
+        self.max_outbound_queue = 256
+        # How long a writer holds cursor and presence messages to send a
+        # burst of them as one frame
+        self.presence_tick = 0.02
+        # Cross-worker fan-out, started by start_fanout() when Redis is set;
+        # the worker subscribes to the channels of documents it has open
+        self.instance_id = uuid.uuid4().hex
+        # Site IDs are unique per worker by the counter, and across workers
+        # and restarts by the instance prefix
+        self.site_counter = itertools.count()
+        self.redis = None
+        self.pubsub = None
+        self.listener_task: Optional[asyncio.Task] = None
+        # Encoded messages for peer workers, drained by publisher_task so a
+        # slow Redis never holds up local delivery
+        self.publish_queue: Optional[asyncio.Queue] = None
+        self.publisher_task: Optional[asyncio.Task] = None
+        self.max_publish_queue = 10_000
+        # Most queued messages sent to Redis in one pipeline
+        self.max_publish_batch = 256
+        # Document ID -> operations from peers that arrived while loading
+        self.pending_remote_ops: Dict[str, List[dict]] = {}
+        # Document ID -> future resolved by a peer's state snapshot
+        self.state_waiters: Dict[str, asyncio.Future] = {}
+        # How long a worker loading a document waits for a peer's snapshot
+        self.peer_state_timeout = 0.25
+        # Message type -> handler taking (websocket, data)
+        self._dispatch = {
+            "operation": self._handle_crdt_operation,
+            "cursor": self._handle_cursor_update,
+            "presence": self._handle_presence_update,
+        }
     
     async def connect(
         self, 
         websocket: WebSocket, 
         document_id: str, 
-        user: Optional[models.User],
-        db: Session
+        user: Optional[models.User]
     ):
         """Accept a new WebSocket connection"""
-        logger.info(f"Manager.connect called for document {document_id}, user: {user.username if user else 'None'}")
+        # Every connection to a document then shares one key object, so
+        # per-message dict lookups match it by identity
+        document_id = sys.intern(document_id)
+        logger.info("Manager.connect called for document %s, user: %s",
+                    document_id, user.username if user else None)
         await websocket.accept()
         logger.debug("WebSocket accepted")
         
         # Initialize document connections if not exists
         if document_id not in self.active_connections:
             self.active_connections[document_id] = set()
+            # Hear peers' operations before loading, so none fall between
+            await self._subscribe(document_id)
         
         # Add connection
         self.active_connections[document_id].add(websocket)
-        logger.debug(f"Added connection to document {document_id}")
+        logger.debug("Added connection to document %s", document_id)
         
         # Generate site ID for CRDT
-        site_id = f"{user.id if user else 'guest'}_{uuid.uuid4().hex[:8]}"
-        logger.debug(f"Generated site_id: {site_id}")
-        
-        # Store connection info
-        self.connection_info[websocket] = {
-            "document_id": document_id,
-            "user": user,
-            "site_id": site_id,
-            "connected_at": datetime.utcnow()
-        }
+        site_id = f"{user.id if user else 'guest'}_{self.instance_id[:8]}{next(self.site_counter):x}"
+        logger.debug("Generated site_id: %s", site_id)
+        
+        # Store connection info, with the queue its writer task drains
+        out_queue = asyncio.Queue(maxsize=self.max_outbound_queue)
+        info = self.connection_info[websocket] = ConnectionInfo(
+            document_id=document_id,
+            user=user,
+            site_id=site_id,
+            connected_at=time.monotonic_ns(),
+            identity={
+                "user_id": user.id if user else None,
+                "username": user.username if user else "Guest",
+                "site_id": site_id
+            },
+            out_queue=out_queue,
+            writer_task=asyncio.create_task(self._writer_loop(websocket, out_queue))
+        )
         
         # Initialize or load CRDT for document
-        logger.debug(f"Initializing CRDT for document {document_id}")
-        await self._initialize_document_crdt(document_id, site_id, db)
+        logger.debug("Initializing CRDT for document %s", document_id)
+        await self._initialize_document_crdt(document_id, site_id)
         logger.debug("CRDT initialized successfully")
         
         # Create session record
         session = models.DocumentSession(
+            id=models.uuid7(),
             document_id=document_id,
             user_id=user.id if user else None,
             session_id=str(uuid.uuid4()),
             site_id=site_id,
             is_active=True
         )
-        db.add(session)
-        db.commit()
+        async with AsyncSessionLocal() as db:
+            db.add(session)
+            await db.commit()
+        info.session_pk = session.id
         logger.debug("Session record created")
         
         # Send initial document state
@@ -112,106 +221,99 @@ class ConnectionManager:
         logger.debug("Initial state sent")
         
         # Notify other users about new connection
-        await self._broadcast_presence_update(document_id, "user_joined", {
-            "user_id": user.id if user else None,
-            "username": user.username if user else "Guest",
-            "site_id": site_id
-        })
+        await self._broadcast_presence_update(document_id, "user_joined", info.identity)
         logger.info("Connection setup completed successfully")
     
-    async def disconnect(self, websocket: WebSocket, db: Session):
+    async def disconnect(self, websocket: WebSocket):
         """Handle WebSocket disconnection"""
-        async with self.cleanup_lock:
-            if websocket not in self.connection_info:
-                return
-            
-            info = self.connection_info[websocket]
-            document_id = info["document_id"]
-            user = info["user"]
-            site_id = info["site_id"]
+        # Taken up front, so a second disconnect of the same connection
+        # returns at once; nothing else needs a lock on a single loop
+        info = self.connection_info.pop(websocket, None)
+        if info is None:
+            return
+        
+        document_id = info.document_id
+        site_id = info.site_id
+        
+        # Let the writer flush, then stop
+        try:
+            info.out_queue.put_nowait(None)
+        except asyncio.QueueFull:
+            info.writer_task.cancel()
+        
+        # Remove from active connections
+        connections = self.active_connections.get(document_id)
+        if connections is not None:
+            connections.discard(websocket)
             
-            # Remove from active connections
-            if document_id in self.active_connections:
-                self.active_connections[document_id].discard(websocket)
-                
-                # Clean up empty document connections
-                if not self.active_connections[document_id]:
-                    del self.active_connections[document_id]
-                    # Save final state before cleanup
-                    await self._save_document_state(document_id, db)
-                    # Cancel any pending save tasks
+            # Clean up empty document connections
+            if not connections:
+                del self.active_connections[document_id]
+                # Save final state before cleanup
+                await self._save_document_state(document_id, snapshot=True)
+                # Someone may have opened the document during the save
+                if document_id not in self.active_connections:
+                    # Stop the document's flusher
                     if document_id in self.save_tasks:
-                        self.save_tasks[document_id].cancel()
-                        del self.save_tasks[document_id]
+                        self.save_tasks.pop(document_id).cancel()
+                    self.dirty.pop(document_id, None)
+                    self.initial_state_cache.pop(document_id, None)
+                    if self.redis is not None:
+                        # Unsubscribed, the cached copy would go stale
+                        await self._unsubscribe(document_id)
+                        self.document_crdts.pop(document_id, None)
                     # Note: CRDT will be automatically removed from LRU cache when space is needed
-            
-            # Remove connection info
-            del self.connection_info[websocket]
-            
-            try:
-                # Update session as inactive
-                session = db.query(models.DocumentSession).filter(
-                    models.DocumentSession.site_id == site_id,
-                    models.DocumentSession.is_active == True
-                ).first()
-                if session:
-                    session.is_active = False
-                    session.last_seen = datetime.utcnow()
-                    db.commit()
-            except Exception as e:
-                logger.error(f"Error updating session for site_id {site_id}: {e}")
-                db.rollback()
-            
-            # Notify other users about disconnection
-            try:
-                await self._broadcast_presence_update(document_id, "user_left", {
-                    "user_id": user.id if user else None,
-                    "username": user.username if user else "Guest",
-                    "site_id": site_id
-                })
-            except Exception as e:
-                logger.error(f"Error broadcasting disconnect presence: {e}")
+        
+        try:
+            # Update session as inactive, by the key kept since connect
+            if info.session_pk is not None:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(models.DocumentSession)
+                        .where(models.DocumentSession.id == info.session_pk)
+                        .values(is_active=False, last_seen=datetime.utcnow())
+                    )
+                    await db.commit()
+        except Exception as e:
+            logger.error(f"Error updating session for site_id {site_id}: {e}")
+        
+        # Notify other users about disconnection
+        try:
+            await self._broadcast_presence_update(document_id, "user_left", info.identity)
+        except Exception as e:
+            logger.error(f"Error broadcasting disconnect presence: {e}")
     
-    async def handle_message(self, websocket: WebSocket, message: str, db: Session):
+    async def handle_message(self, websocket: WebSocket, message: Union[str, bytes]):
         """Handle incoming WebSocket message"""
         try:
-            data = json.loads(message)
+            data = orjson.loads(message)
             message_type = data.get("type")
             
-            if message_type == "operation":
-                await self._handle_crdt_operation(websocket, data, db)
-            elif message_type == "cursor":
-                await self._handle_cursor_update(websocket, data)
-            elif message_type == "presence":
-                await self._handle_presence_update(websocket, data)
+            handler = self._dispatch.get(message_type)
+            if handler is not None:
+                await handler(websocket, data)
             else:
-                await websocket.send_text(json.dumps({
+                await self._send(websocket, {
                     "type": "error",
                     "message": f"Unknown message type: {message_type}"
-                }))
+                })
         
-        except json.JSONDecodeError:
-            await websocket.send_text(json.dumps({
-                "type": "error",
-                "message": "Invalid JSON message"
-            }))
+        except orjson.JSONDecodeError:
+            await self._send(websocket, _ERR_INVALID_JSON)
         except Exception as e:
-            await websocket.send_text(json.dumps({
+            await self._send(websocket, {
                 "type": "error",
                 "message": f"Error processing message: {str(e)}"
-            }))
+            })
     
-    async def _handle_crdt_operation(self, websocket: WebSocket, data: dict, db: Session):
+    async def _handle_crdt_operation(self, websocket: WebSocket, data: dict):
         """Handle CRDT operation from client"""
         info = self.connection_info[websocket]
-        document_id = info["document_id"]
-        site_id = info["site_id"]
+        document_id = info.document_id
+        site_id = info.site_id
         
         if document_id not in self.document_crdts:
-            await websocket.send_text(json.dumps({
-                "type": "error",
-                "message": "Document not initialized"
-            }))
+            await self._send(websocket, _ERR_NOT_INITIALIZED)
             return
         
         try:
@@ -224,92 +326,131 @@ class ConnectionManager:
             success = crdt.apply_remote(operation)
             
             if success:
+                self.initial_state_cache.pop(document_id, None)
+                self.unsaved_operations.setdefault(document_id, []).append(orjson.dumps(op_data))
+                
                 # Broadcast to other clients
                 await self._broadcast_operation(document_id, operation, exclude=websocket)
                 
                 # Schedule save
-                self._schedule_save(document_id, db)
+                self._schedule_save(document_id)
             else:
-                await websocket.send_text(json.dumps({
-                    "type": "error",
-                    "message": "Failed to apply operation"
-                }))
+                await self._send(websocket, _ERR_APPLY_FAILED)
         
         except Exception as e:
-            await websocket.send_text(json.dumps({
+            await self._send(websocket, {
                 "type": "error",
                 "message": f"Error processing operation: {str(e)}"
-            }))
+            })
     
     async def _handle_cursor_update(self, websocket: WebSocket, data: dict):
         """Handle cursor position update"""
         info = self.connection_info[websocket]
-        document_id = info["document_id"]
+        document_id = info.document_id
         
         cursor_data = data.get("cursor", {})
-        cursor_data["site_id"] = info["site_id"]
-        cursor_data["user_id"] = info["user"].id if info["user"] else None
-        cursor_data["username"] = info["user"].username if info["user"] else "Guest"
+        cursor_data.update(info.identity)
         
         # Broadcast cursor update to other clients
         await self._broadcast_message(document_id, {
             "type": "cursor",
             "cursor": cursor_data
-        }, exclude=websocket)
+        }, exclude=websocket, urgent=False)
     
     async def _handle_presence_update(self, websocket: WebSocket, data: dict):
         """Handle presence update (typing indicators, etc.)"""
         info = self.connection_info[websocket]
-        document_id = info["document_id"]
+        document_id = info.document_id
         
         presence_data = data.get("presence", {})
-        presence_data["site_id"] = info["site_id"]
-        presence_data["user_id"] = info["user"].id if info["user"] else None
-        presence_data["username"] = info["user"].username if info["user"] else "Guest"
+        presence_data.update(info.identity)
         
         # Broadcast presence update to other clients
         await self._broadcast_message(document_id, {
             "type": "presence",
             "presence": presence_data
-        }, exclude=websocket)
+        }, exclude=websocket, urgent=False)
     
-    async def _initialize_document_crdt(self, document_id: str, site_id: str, db: Session):
+    async def _initialize_document_crdt(self, document_id: str, site_id: str):
         """Initialize or load CRDT for a document"""
-        if document_id in self.document_crdts:
-            return
-        
-        # Load document from database
-        document = db.query(models.Document).filter(
-            models.Document.id == document_id
-        ).first()
+        # Clients joining during a load wait for it instead of loading again
+        lock = self.init_locks.setdefault(document_id, asyncio.Lock())
+        try:
+            async with lock:
+                if document_id in self.document_crdts:
+                    return
+                
+                if self.redis is not None:
+                    self.pending_remote_ops[document_id] = []
+                try:
+                    crdt = await self._load_document_crdt(document_id, site_id)
+                    # Catch up on peer operations that arrived while loading
+                    for op_data in self.pending_remote_ops.get(document_id, ()):
+                        crdt.apply_remote(CRDTOperation.from_dict(op_data))
+                finally:
+                    self.pending_remote_ops.pop(document_id, None)
+                
+                self.document_crdts[document_id] = crdt
+        finally:
+            if not lock.locked():
+                self.init_locks.pop(document_id, None)
+    
+    async def _load_document_crdt(self, document_id: str, site_id: str) -> SequenceCRDT:
+        """Build a document's CRDT from a peer worker or the database"""
+        # Load the snapshot and the operations logged since
+        async with AsyncSessionLocal() as db:
+            document = await db.get(
+                models.Document, document_id,
+                options=[undefer(models.Document.crdt_state)]
+            )
+            if not document:
+                raise ValueError(f"Document {document_id} not found")
+            logged = (await db.execute(
+                select(models.DocumentOperation.operation)
+                .where(models.DocumentOperation.document_id == document_id)
+                .order_by(models.DocumentOperation.id)
+            )).scalars().all()
         
-        if not document:
-            raise ValueError(f"Document {document_id} not found")
+        # A worker already editing the document has newer state than
+        # its last save
+        peer_state = await self._request_peer_state(document_id)
+        if peer_state is not None:
+            return SequenceCRDT.from_dict(peer_state)
         
         # Initialize CRDT
         if document.crdt_state:
             # Load existing state
-            crdt_data = json.loads(document.crdt_state)
+            crdt_data = decode_crdt(document.crdt_state)
             crdt = SequenceCRDT.from_dict(crdt_data)
         else:
             # Create new CRDT
             crdt = SequenceCRDT(site_id)
         
-        self.document_crdts[document_id] = crdt
+        # Replay operations logged since the snapshot; entries the
+        # snapshot already contains are no-ops
+        for blob in logged:
+            crdt.apply_remote(CRDTOperation.from_dict(orjson.loads(blob)))
+        
+        return crdt
     
     async def _send_initial_state(self, websocket: WebSocket, document_id: str):
         """Send initial document state to newly connected client"""
         if document_id not in self.document_crdts:
             return
         
-        crdt = self.document_crdts[document_id]
+        # Clients joining an unchanged document share one encoding
+        payload = self.initial_state_cache.get(document_id)
+        if payload is None:
+            crdt = self.document_crdts[document_id]
+            payload = self.initial_state_cache[document_id] = orjson.dumps({
+                "type": "initial_state",
+                "document_id": document_id,
+                "crdt_state": crdt.to_dict(),
+                "text": crdt.get_text()
+            })
         
-        await websocket.send_text(json.dumps({
-            "type": "initial_state",
-            "document_id": document_id,
-            "crdt_state": crdt.to_dict(),
-            "text": crdt.get_text()
-        }))
+        # Through the writer, so it stays ahead of broadcasts queued later
+        self.connection_info[websocket].out_queue.put_nowait((payload, True))
     
     async def _broadcast_operation(
         self, 
@@ -318,12 +459,13 @@ class ConnectionManager:
         exclude: Optional[WebSocket] = None
     ):
         """Broadcast CRDT operation to all clients in document"""
+        op_data = operation.to_dict()
         message = {
             "type": "operation",
-            "operation": operation.to_dict()
+            "operation": op_data
         }
         
-        await self._broadcast_message(document_id, message, exclude)
+        await self._broadcast_message(document_id, message, exclude, operation=op_data)
     
     async def _broadcast_presence_update(
         self, 
@@ -344,101 +486,348 @@ class ConnectionManager:
         self, 
         document_id: str, 
         message: dict, 
-        exclude: Optional[WebSocket] = None
+        exclude: Optional[WebSocket] = None,
+        urgent: bool = True,
+        operation: Optional[dict] = None
     ):
-        """Broadcast message to all clients in document"""
+        """
+        Broadcast message to all clients in document, on this worker and
+        on peer workers.
+
+        Messages that are not urgent (cursor and presence ticks) may be
+        held briefly and sent together with the ones that follow.
+        """
+        # Nobody else here, as when editing alone: skip encoding
+        connections = self.active_connections.get(document_id)
+        if connections and not (len(connections) == 1 and exclude in connections):
+            # Encoded once as bytes; send_text would re-encode it per recipient
+            await self._deliver_local(document_id, orjson.dumps(message), exclude, urgent)
+        
+        self._publish(document_id, message=message, urgent=urgent, operation=operation)
+    
+    async def _deliver_local(
+        self, 
+        document_id: str, 
+        payload: bytes, 
+        exclude: Optional[WebSocket] = None,
+        urgent: bool = True
+    ):
+        """Queue an encoded message for this worker's clients in document"""
         if document_id not in self.active_connections:
             return
         
-        message_str = json.dumps(message)
-        connections = self.active_connections[document_id].copy()
         broken_connections = []
         
-        for connection in connections:
+        # Queue without awaiting, so one slow client cannot stall the rest
+        for connection in self.active_connections[document_id]:
             if connection == exclude:
                 continue
             
+            info = self.connection_info.get(connection)
+            if info is None:
+                continue
             try:
-                await connection.send_text(message_str)
-            except Exception as e:
-                logger.warning(f"Failed to send message to connection: {e}")
-                # Mark connection as broken
+                info.out_queue.put_nowait((payload, urgent))
+            except asyncio.QueueFull:
+                logger.warning("Outbound queue full, dropping slow connection")
                 broken_connections.append(connection)
         
-        # Clean up broken connections
+        # Clean up broken connections off the broadcast path, since a
+        # disconnect may save the document
         if broken_connections:
-            # Get a database session for cleanup
-            from database import SessionLocal
-            db = SessionLocal()
+            task = asyncio.create_task(self._disconnect_all(broken_connections))
+            self.cleanup_tasks.add(task)
+            task.add_done_callback(self.cleanup_tasks.discard)
+    
+    async def _disconnect_all(self, connections: List[WebSocket]):
+        """Disconnect several connections, logging rather than raising"""
+        results = await asyncio.gather(
+            *(self.disconnect(connection) for connection in connections),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Error disconnecting dropped connection: {result}")
+    
+    async def _send(self, websocket: WebSocket, message: Union[dict, bytes]):
+        """Queue a reply to one connection, behind what it already has queued"""
+        info = self.connection_info.get(websocket)
+        if info is None:
+            return
+        if type(message) is not bytes:
+            message = orjson.dumps(message)
+        try:
+            info.out_queue.put_nowait((message, True))
+        except asyncio.QueueFull:
+            logger.warning("Outbound queue full, dropping reply")
+    
+    async def _writer_loop(self, websocket: WebSocket, out_queue: asyncio.Queue):
+        """
+        Send a connection's queued (payload, urgent) messages in order
+        until told to stop, merging a backlog into one frame
+        """
+        while True:
+            item = await out_queue.get()
+            if item is None:
+                return
+            
+            message, urgent = item
+            if not urgent:
+                # Let the rest of a cursor burst catch up
+                await asyncio.sleep(self.presence_tick)
+            
+            messages = [message]
+            stop = False
+            while not out_queue.empty():
+                item = out_queue.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                messages.append(item[0])
+            
             try:
-                for connection in broken_connections:
-                    await self.disconnect(connection, db)
-            finally:
-                db.close()
+                # Records are separated by U+001E, which JSON never contains
+                await websocket.send_bytes(b"\x1e".join(messages))
+            except Exception as e:
+                logger.warning(f"Failed to send message to connection: {e}")
+                return
+            if stop:
+                return
     
-    def _schedule_save(self, document_id: str, db: Session):
-        """Schedule document save with debouncing"""
-        self.last_save_times[document_id] = datetime.utcnow()
-        
-        # Cancel existing save task if any
-        if document_id in self.save_tasks:
-            self.save_tasks[document_id].cancel()
+    async def start_fanout(self, redis_url: Optional[str] = REDIS_URL):
+        """Exchange broadcasts with other workers when Redis is configured"""
+        if not redis_url or self.redis is not None:
+            return
+        if aioredis is None:
+            logger.warning("REDIS_URL is set but the redis package is not installed")
+            return
         
-        # Create new save task
-        task = asyncio.create_task(self._delayed_save(document_id, db))
-        self.save_tasks[document_id] = task
+        # One pool for publishing; the pub/sub connection holds every
+        # document subscription
+        self.redis = aioredis.from_url(redis_url, max_connections=64)
+        self.pubsub = self.redis.pubsub()
+        self.publish_queue = asyncio.Queue(maxsize=self.max_publish_queue)
+        self.publisher_task = asyncio.create_task(self._fanout_publisher(self.publish_queue))
+        for document_id in self.active_connections:
+            await self._subscribe(document_id)
+        logger.info("Broadcast fan-out enabled for worker %s", self.instance_id)
+    
+    async def stop_fanout(self):
+        """Stop exchanging broadcasts with other workers"""
+        if self.listener_task is not None:
+            self.listener_task.cancel()
+            self.listener_task = None
+        if self.publisher_task is not None:
+            self.publisher_task.cancel()
+            self.publisher_task = None
+        self.publish_queue = None
+        if self.pubsub is not None:
+            await self.pubsub.close()
+            self.pubsub = None
+        if self.redis is not None:
+            await self.redis.close()
+            self.redis = None
     
-    async def _delayed_save(self, document_id: str, db: Session):
-        """Save document after delay (debounced)"""
+    async def _subscribe(self, document_id: str):
+        """Start hearing peer workers' traffic for a document"""
+        if self.pubsub is None:
+            return
         try:
-            await asyncio.sleep(self.save_delay)
+            await self.pubsub.subscribe(CHANNEL_PREFIX + document_id)
+        except Exception as e:
+            logger.error(f"Fan-out subscribe error for document {document_id}: {e}")
+            return
+        # The listener ends whenever the last channel is unsubscribed
+        if self.listener_task is None or self.listener_task.done():
+            self.listener_task = asyncio.create_task(self._fanout_listener(self.pubsub))
+    
+    async def _unsubscribe(self, document_id: str):
+        """Stop hearing peer workers' traffic for a document"""
+        if self.pubsub is None:
+            return
+        try:
+            await self.pubsub.unsubscribe(CHANNEL_PREFIX + document_id)
+        except Exception as e:
+            logger.error(f"Fan-out unsubscribe error for document {document_id}: {e}")
+    
+    def _publish(self, document_id: str, **fields):
+        """Queue a message for peer workers; a no-op without fan-out"""
+        if self.publish_queue is None:
+            return
+        envelope = {"origin": self.instance_id, "document_id": document_id}
+        envelope.update(fields)
+        try:
+            self.publish_queue.put_nowait((document_id, orjson.dumps(envelope)))
+        except asyncio.QueueFull:
+            logger.warning(f"Fan-out queue full, dropping message for document {document_id}")
+    
+    async def _fanout_publisher(self, queue: asyncio.Queue):
+        """Publish queued peer messages, pipelining a backlog"""
+        while True:
+            items = [await queue.get()]
+            while len(items) < self.max_publish_batch and not queue.empty():
+                items.append(queue.get_nowait())
             
-            # Check if there were more recent changes
-            if (document_id in self.last_save_times and 
-                (datetime.utcnow() - self.last_save_times[document_id]).total_seconds() >= self.save_delay):
-                await self._save_document_state(document_id, db)
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for document_id, payload in items:
+                        pipe.publish(CHANNEL_PREFIX + document_id, payload)
+                    await pipe.execute()
+            except Exception as e:
+                logger.error(f"Fan-out publish error: {e}")
+    
+    async def _fanout_listener(self, pubsub):
+        """Apply and deliver messages published by peer workers"""
+        try:
+            async for item in pubsub.listen():
+                if item.get("type") != "message":
+                    continue
+                try:
+                    envelope = orjson.loads(item["data"])
+                except orjson.JSONDecodeError:
+                    continue
+                if envelope.get("origin") == self.instance_id:
+                    continue
+                await self._handle_peer_message(envelope)
         except asyncio.CancelledError:
-            # Task was cancelled, that's fine
             pass
-        finally:
-            # Clean up task reference
-            if document_id in self.save_tasks:
-                del self.save_tasks[document_id]
+        except Exception as e:
+            logger.error(f"Fan-out listener stopped: {e}")
     
-    async def _save_document_state(self, document_id: str, db: Session):
-        """Save current CRDT state to database"""
-        if document_id not in self.document_crdts:
+    async def _handle_peer_message(self, envelope: dict):
+        """Handle one message from another worker"""
+        document_id = envelope.get("document_id")
+        
+        if envelope.get("state_request"):
+            crdt = self.document_crdts.get(document_id)
+            if crdt is not None:
+                self._publish(document_id, state=crdt.to_dict())
             return
         
+        if "state" in envelope:
+            waiter = self.state_waiters.get(document_id)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(envelope["state"])
+            return
+        
+        # Keep the cached copy current; the origin worker logs the operation
+        op_data = envelope.get("operation")
+        if op_data is not None:
+            pending = self.pending_remote_ops.get(document_id)
+            crdt = self.document_crdts.get(document_id)
+            if pending is not None:
+                pending.append(op_data)
+            elif crdt is not None:
+                crdt.apply_remote(CRDTOperation.from_dict(op_data))
+                self.initial_state_cache.pop(document_id, None)
+        
+        message = envelope.get("message")
+        if message is not None:
+            await self._deliver_local(
+                document_id, orjson.dumps(message), urgent=envelope.get("urgent", True)
+            )
+    
+    async def _request_peer_state(self, document_id: str) -> Optional[dict]:
+        """Ask peer workers for their copy of a document's state"""
+        if self.publish_queue is None:
+            return None
+        
+        waiter = asyncio.get_running_loop().create_future()
+        self.state_waiters[document_id] = waiter
+        self._publish(document_id, state_request=True)
         try:
-            crdt = self.document_crdts[document_id]
-            crdt_state_json = json.dumps(crdt.to_dict())
-            
-            # Check size limit (5MB)
-            if len(crdt_state_json) > 5_242_880:  # 5MB in bytes
-                logger.error(f"Document {document_id} CRDT state too large: {len(crdt_state_json)} bytes")
-                # Clean up the CRDT to prevent memory issues
-                del self.document_crdts[document_id]
-                return
+            return await asyncio.wait_for(waiter, self.peer_state_timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.state_waiters.pop(document_id, None)
+    
+    def _schedule_save(self, document_id: str):
+        """Mark a document as changed, starting its flusher on first use"""
+        dirty = self.dirty.get(document_id)
+        if dirty is None:
+            dirty = self.dirty[document_id] = asyncio.Event()
+            self.save_tasks[document_id] = asyncio.create_task(
+                self._flusher_loop(document_id, dirty)
+            )
+        dirty.set()
+    
+    async def _flusher_loop(self, document_id: str, dirty: asyncio.Event):
+        """Save a document at most once per save_delay while it has changes"""
+        try:
+            while True:
+                await dirty.wait()
+                await asyncio.sleep(self.save_delay)
+                # Changes from here on mark it dirty for the next round
+                dirty.clear()
+                await self._save_document_state(document_id)
+        except asyncio.CancelledError:
+            pass
+    
+    async def _save_document_state(self, document_id: str, snapshot: bool = False):
+        """
+        Persist a document: log new operations, and rewrite the full state
+        when asked to or once enough operations have been logged.
+        """
+        operations = self.unsaved_operations.pop(document_id, [])
+        try:
+            now = datetime.utcnow()
+            logged = self.logged_since_snapshot.get(document_id, 0) + len(operations)
             
-            # Update document in database
-            document = db.query(models.Document).filter(
-                models.Document.id == document_id
-            ).first()
+            state_blob = word_count = None
+            crdt = self.document_crdts.get(document_id)
+            if crdt is not None and (snapshot or logged >= self.snapshot_interval):
+                # to_dict() builds fresh containers and the text is
+                # immutable, so both can be processed off the loop while
+                # editing continues, and the word count matches the state
+                loop = asyncio.get_running_loop()
+                state_blob, word_count = await loop.run_in_executor(
+                    _cpu_pool, _encode_snapshot, crdt.to_dict(), crdt.get_text()
+                )
+                
+                # Check size limit (5MB)
+                if len(state_blob) > 5_242_880:  # 5MB in bytes
+                    logger.error(f"Document {document_id} CRDT state too large: {len(state_blob)} bytes")
+                    # Clean up the CRDT to prevent memory issues; the
+                    # operations are still logged below
+                    self.document_crdts.pop(document_id, None)
+                    self.initial_state_cache.pop(document_id, None)
+                    state_blob = None
             
-            if document:
-                document.crdt_state = crdt_state_json
-                document.updated_at = datetime.utcnow()
+            async with AsyncSessionLocal() as db:
+                if operations:
+                    await db.execute(insert(models.DocumentOperation), [
+                        {"document_id": document_id, "operation": op, "created_at": now}
+                        for op in operations
+                    ])
                 
-                # Calculate and update word count
-                from routers.documents import calculate_word_count
-                document.word_count = calculate_word_count(crdt_state_json)
+                if state_blob is not None:
+                    # Update document in database, with the word count so
+                    # listings never decompress the state
+                    await db.execute(
+                        update(models.Document)
+                        .where(models.Document.id == document_id)
+                        .values(
+                            crdt_state=state_blob,
+                            updated_at=now,
+                            word_count=word_count
+                        )
+                    )
+                    await db.execute(
+                        delete(models.DocumentOperation).where(
+                            models.DocumentOperation.document_id == document_id,
+                            models.DocumentOperation.created_at < now - self.oplog_retention
+                        )
+                    )
+                    logged = 0
                 
-                db.commit()
+                await db.commit()
+            self.logged_since_snapshot[document_id] = logged
         
         except Exception as e:
             logger.error(f"Error saving document {document_id}: {e}")
-            db.rollback()
+            # Keep the operations for the next save
+            self.unsaved_operations[document_id] = operations + self.unsaved_operations.get(document_id, [])
 
     
     async def cleanup_stale_connections(self):
@@ -447,21 +836,19 @@ class ConnectionManager:
             try:
                 await asyncio.sleep(60)  # Run every minute
                 
-                async with self.cleanup_lock:
-                    # Check all connections
-                    all_websockets = list(self.connection_info.keys())
-                    for ws in all_websockets:
-                        try:
-                            # Try to ping the connection
-                            await ws.send_text(json.dumps({"type": "ping"}))
-                        except Exception:
-                            # Connection is stale, clean it up
-                            from database import SessionLocal
-                            db = SessionLocal()
-                            try:
-                                await self.disconnect(ws, db)
-                            finally:
-                                db.close()
+                # Liveness is probed with protocol-level ping frames by the
+                # server (ws_ping_interval), which closes unresponsive
+                # sockets; only connections whose writer has already given
+                # up on a failed send are left to collect here
+                stale = [
+                    ws for ws, info in self.connection_info.items()
+                    if info.writer_task.done()
+                ]
+                
+                # Clean up stale connections concurrently, so one slow
+                # final save does not hold up the rest
+                if stale:
+                    await self._disconnect_all(stale)
             except Exception as e:
                 logger.error(f"Error in cleanup task: {e}")
     
@@ -471,7 +858,7 @@ class ConnectionManager:
             "total_connections": len(self.connection_info),
             "active_documents": len(self.active_connections),
             "cached_crdts": len(self.document_crdts),
-            "pending_saves": len(self.save_tasks),
+            "pending_saves": sum(1 for dirty in self.dirty.values() if dirty.is_set()),
             "connections_by_document": {
                 doc_id: len(connections) 
                 for doc_id, connections in self.active_connections.items()
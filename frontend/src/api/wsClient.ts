@@ -34,6 +34,7 @@ export class WebSocketClient {
   private maxReconnectDelay = 30000; // Max 30 seconds
   private reconnectTimer: NodeJS.Timeout | null = null;
   private isManuallyDisconnected = false;
+  private decoder = new TextDecoder();
   
   // Event handlers
   private onOperationHandler?: (operation: CRDTOperation) => void;
@@ -65,6 +66,8 @@ export class WebSocketClient {
     try {
       const wsUrl = `${this.baseUrl}/ws/${this.documentId}${this.token ? `?token=${this.token}` : ''}`;
       this.ws = new WebSocket(wsUrl);
+      // Broadcasts may arrive as binary frames of UTF-8 JSON
+      this.ws.binaryType = 'arraybuffer';
 
       this.ws.onopen = this.handleOpen.bind(this);
       this.ws.onmessage = this.handleMessage.bind(this);
@@ -148,8 +151,17 @@ export class WebSocketClient {
   }
 
   private handleMessage(event: MessageEvent): void {
+    // The server may merge queued messages into one frame, separated by
+    // the record separator character (never present in encoded JSON)
+    const data = typeof event.data === 'string' ? event.data : this.decoder.decode(event.data);
+    for (const record of data.split('\x1e')) {
+      this.dispatchMessage(record);
+    }
+  }
+
+  private dispatchMessage(data: string): void {
     try {
-      const message: WSMessage = JSON.parse(event.data);
+      const message: WSMessage = JSON.parse(data);
       
       switch (message.type) {
         case 'operation':
@@ -158,6 +170,14 @@ export class WebSocketClient {
           }
           break;
           
+        case 'operation_batch':
+          if (Array.isArray(message.ops) && this.onOperationHandler) {
+            for (const operation of message.ops) {
+              this.onOperationHandler(operation);
+            }
+          }
+          break;
+          
         case 'cursor':
           if (message.cursor && this.onPresenceHandler) {
             this.onPresenceHandler(message.cursor);
@@ -1,8 +1,6 @@
 /**
  * Optimized client-side CRDT implementation
  */
-import pako from 'pako';
-
 export interface CRDTNode {
   id: string;
   char: string;
@@ -36,24 +34,12 @@ export class OptimizedClientCRDT {
   }
 
   /**
-   * Initialize from compressed or uncompressed state
+   * Initialize from an initial_state message; the transport's
+   * permessage-deflate takes care of compression
    */
   initializeFromState(data: any) {
     try {
-      let state: CRDTState;
-      
-      if (data.compressed) {
-        // Decode and decompress
-        const decoded = atob(data.data);
-        const bytes = new Uint8Array(decoded.length);
-        for (let i = 0; i < decoded.length; i++) {
-          bytes[i] = decoded.charCodeAt(i);
-        }
-        const decompressed = pako.ungzip(bytes, { to: 'string' });
-        state = JSON.parse(decompressed);
-      } else {
-        state = data.crdt_state;
-      }
+      const state: CRDTState = data.crdt_state;
 
       this.siteId = state.site_id;
       this.version = state.version || 0;
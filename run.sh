@@ -136,6 +136,26 @@ check_requirements() {
     fi
 }
 
+# Compile the CRDT modules with mypyc (run from backend/). The compiled
+# extensions sit next to the sources and take precedence on import; if
+# compilation fails the pure-Python modules are used unchanged.
+compile_crdt() {
+    print_status "Compiling CRDT core with mypyc..."
+    pip install "mypy==1.7.1" > /dev/null 2>&1
+    # mypyc reports type errors on stdout and compiler errors on stderr;
+    # keep both so a failure can be shown, not just the build chatter
+    local log
+    if log=$(mypyc crdt/node.py crdt/sequence.py crdt/optimized_crdt.py 2>&1); then
+        print_success "CRDT core compiled"
+    else
+        echo "$log" | tail -n 20 >&2
+        # The shared runtime extension and build tree land in backend/
+        rm -rf build
+        rm -f crdt/*.so ./*__mypyc*.so
+        print_warning "mypyc compilation failed, using pure-Python CRDT"
+    fi
+}
+
 # Setup function
 setup_project() {
     print_header
@@ -171,6 +191,11 @@ setup_project() {
         print_error "Failed to install backend dependencies"
         exit 1
     fi
+    
+    # Optionally compile the CRDT core to C extensions with mypyc
+    if [[ "${COMPILE_CRDT:-0}" == "1" ]]; then
+        compile_crdt
+    fi
     cd ..
     
     # Install frontend dependencies
@@ -254,6 +279,9 @@ start_dev() {
     cd backend
     uvicorn main:app --host 0.0.0.0 --port 8000 --reload \
         --limit-max-requests 1000 \
+        --ws-max-size 1048576 \
+        --ws-per-message-deflate true \
+        --loop uvloop --http httptools --ws websockets \
         --timeout-keep-alive 5 &
     BACKEND_PID=$!
     cd ..
@@ -339,6 +367,9 @@ start_prod() {
     uvicorn main:app --host 0.0.0.0 --port 8000 \
         --workers 4 \
         --limit-max-requests 1000 \
+        --ws-max-size 1048576 \
+        --ws-per-message-deflate true \
+        --loop uvloop --http httptools --ws websockets \
         --timeout-keep-alive 5 \
         --access-log &
     BACKEND_PID=$!
@@ -40,6 +40,11 @@ python -m uvicorn main:app \
     --reload \
     --log-level info \
     --reload-dir . \
+    --loop uvloop \
+    --http httptools \
+    --ws websockets \
+    --ws-max-size 1048576 \
+    --ws-per-message-deflate true \
     2>&1 | tee backend.log &
 BACKEND_PID=$!
 cd ..